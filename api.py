@@ -0,0 +1,313 @@
+"""
+Local read-only JSON API over the project database, for tools that would
+otherwise scrape the app or copy the SQLite file. Runs next to app.py and
+reads through the same utils query layer. Requests never change project data.
+make_server opens one connection first, so the schema upgrade and the
+portfolio_stats backfill of a new database (see utils.get_connection) run once
+before any request. The server never writes the app's load snapshot
+(utils.SNAPSHOT_ENABLED is off in this process).
+
+Endpoints (GET and HEAD):
+    /projects                 project headers; ?type= (repeatable), ?q= (name contains, literally), ?modules=1 adds module trees
+    /projects/<id>            one project with its module tree
+    /projects/<id>/modules    its modules as a flat list, parents first, with parent_id and depth
+    /gateways                 open gateways; ?status=upcoming|overdue, ?days=, ?entity_type=module|project,
+                              ?type=, ?project_id=, ?sort=, ?desc=1 (see utils.open_gateways)
+    /stats                    dashboard KPIs; ?type=
+    /changes?since=N          delta export; ?format=jsonl|csv|parquet (see export_changes.py)
+
+Every response has an ETag made of the database id, its change counter and
+today's date (upcoming/overdue move with the date). A request whose
+If-None-Match still matches gets 304 after one small query, without loading
+anything. Lists take ?limit= (default 100, at most 1000) and ?offset=, and
+?fields=id,name keeps only those keys of each item.
+
+Usage:
+    python api.py                                  # http://127.0.0.1:8502
+    python api.py --port 9000 --db synthetic.db
+    curl -s 'http://127.0.0.1:8502/projects?type=Major&fields=id,name&limit=20'
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import utils
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+GZIP_MIN_BYTES = 1024 # Smaller bodies are sent uncompressed
+
+CHANGE_CONTENT_TYPES = {
+    'jsonl': "application/x-ndjson",
+    'csv': "text/csv; charset=utf-8",
+    'parquet': "application/vnd.apache.parquet",
+}
+
+class ApiError(Exception):
+    """A request the API rejects; sent back as {"error": message} with 'status'."""
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+        super().__init__(message)
+
+# --- Query Parameters ---
+
+def _param(query, name, default=None):
+    values = query.get(name)
+    return values[-1] if values else default
+
+def _int_param(query, name, default=None, minimum=None, maximum=None):
+    value = _param(query, name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise ApiError(400, f"{name} must be at least {minimum}")
+    return min(value, maximum) if maximum is not None else value
+
+def _list_param(query, name):
+    """Repeated and/or comma-separated values; None when the parameter is absent."""
+    if name not in query:
+        return None
+    return [v for value in query[name] for v in value.split(",") if v]
+
+def _page(query):
+    return (_int_param(query, "limit", DEFAULT_LIMIT, minimum=0, maximum=MAX_LIMIT),
+            _int_param(query, "offset", 0, minimum=0))
+
+# --- Responses ---
+
+def _public(obj):
+    """Drops the bookkeeping keys load_data adds ('_orig'); LazyProject becomes a plain dict."""
+    if isinstance(obj, dict):
+        return {k: _public(v) for k, v in obj.items() if not str(k).startswith("_")}
+    if isinstance(obj, list):
+        return [_public(v) for v in obj]
+    return obj
+
+def _project_fields(items, query):
+    fields = _list_param(query, "fields")
+    if not fields:
+        return items
+    return [{k: item[k] for k in fields if k in item} for item in items]
+
+def _collection(items, total, limit, offset, query):
+    return {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < total else None,
+        "items": _project_fields(_public(items), query),
+    }
+
+def _load_project(project_id):
+    projects = utils.load_data(project_ids=[project_id])
+    if not projects:
+        raise ApiError(404, f"No project {project_id}")
+    return projects[0]
+
+# --- Endpoints ---
+
+def get_projects(query):
+    limit, offset = _page(query)
+    q = _param(query, "q")
+    ids, total = utils.page_project_ids(types=_list_param(query, "type"), name_like=utils.like_pattern(q) if q else None,
+                                        limit=limit, offset=offset)
+    projects = utils.load_data(project_ids=ids, headers_only=_param(query, "modules") != "1") if ids else []
+    return _collection(projects, total, limit, offset, query)
+
+def get_project(query, project_id):
+    return _project_fields([_public(_load_project(project_id))], query)[0]
+
+def get_project_modules(query, project_id):
+    limit, offset = _page(query)
+    rows = []
+    for m, parent, depth in utils.walk_modules(_load_project(project_id)['modules']):
+        row = {k: v for k, v in m.items() if k != 'sub_modules'}
+        row.update(project_id=project_id, parent_id=parent['id'] if parent else None, depth=depth)
+        rows.append(row)
+    return _collection(rows[offset:offset + limit], len(rows), limit, offset, query)
+
+def get_gateways(query):
+    limit, offset = _page(query)
+    status = _param(query, "status", "upcoming")
+    entity_type = _param(query, "entity_type", "module")
+    sort = _param(query, "sort", "plan_date")
+    if status not in ("upcoming", "overdue"):
+        raise ApiError(400, "status must be upcoming or overdue")
+    if entity_type not in ("module", "project"):
+        raise ApiError(400, "entity_type must be module or project")
+    if sort not in utils.OPEN_GATEWAY_SORTS:
+        raise ApiError(400, f"sort must be one of {', '.join(utils.OPEN_GATEWAY_SORTS)}")
+    # Overdue defaults to any age, upcoming to the dashboard's 30 days
+    days = _int_param(query, "days", 30 if status == "upcoming" else None, minimum=0)
+    project_ids = _list_param(query, "project_id")
+    try:
+        project_ids = [int(p) for p in project_ids] if project_ids is not None else None
+    except ValueError:
+        raise ApiError(400, "project_id must be an integer")
+    rows, total = utils.open_gateways(status, days, entity_type, types=_list_param(query, "type"),
+                                      project_ids=project_ids, sort=sort, descending=_param(query, "desc") == "1",
+                                      limit=limit, offset=offset)
+    return _collection(rows, total, limit, offset, query)
+
+def get_stats(query):
+    stats = utils.portfolio_stats(_list_param(query, "type"))
+    return _project_fields([stats], query)[0]
+
+def get_changes(query):
+    fmt = _param(query, "format", "jsonl")
+    if fmt not in CHANGE_CONTENT_TYPES:
+        raise ApiError(400, f"format must be one of {', '.join(CHANGE_CONTENT_TYPES)}")
+    out = io.BytesIO() if fmt == "parquet" else io.StringIO()
+    result = utils.export_changes(out, _int_param(query, "since"), fmt)
+    if result is None:
+        raise ApiError(501, f"{fmt} export is not available on this server")
+    body = out.getvalue()
+    return CHANGE_CONTENT_TYPES[fmt], body if isinstance(body, bytes) else body.encode("utf-8")
+
+def route(path):
+    """(endpoint function, extra arguments) for a URL path; ApiError 404 if there is none."""
+    parts = [p for p in path.split("/") if p]
+    if parts == ["projects"]:
+        return get_projects, ()
+    if len(parts) in (2, 3) and parts[0] == "projects" and parts[1].isdigit():
+        if len(parts) == 2:
+            return get_project, (int(parts[1]),)
+        if parts[2] == "modules":
+            return get_project_modules, (int(parts[1]),)
+    if parts == ["gateways"]:
+        return get_gateways, ()
+    if parts == ["stats"]:
+        return get_stats, ()
+    if parts == ["changes"]:
+        return get_changes, ()
+    raise ApiError(404, f"No endpoint {path}")
+
+def current_etag():
+    db_uid, change_seq = utils.db_identity()
+    return f'"{db_uid:x}-{change_seq}-{date.today():%Y%m%d}"'
+
+def etag_matches(header, etag):
+    """If-None-Match semantics: '*' or any listed tag (weak or strong) equal to 'etag'."""
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+# --- Server ---
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "AutoPM-API/1.0"
+    quiet = False
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def send_response(self, code, message=None):
+        self.response_started = True
+        super().send_response(code, message)
+
+    def handle_request(self, send_body):
+        url = urlsplit(self.path)
+        self.response_started = False
+        try:
+            endpoint, args = route(url.path)
+            etag = current_etag()
+            if etag_matches(self.headers.get("If-None-Match"), etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                return
+            result = endpoint(parse_qs(url.query), *args)
+            if isinstance(result, tuple):
+                content_type, body = result
+            else:
+                content_type, body = "application/json", json.dumps(result).encode("utf-8")
+            self.send(200, content_type, body, send_body, etag)
+        except ApiError as e:
+            self.send_json_error(e.status, e.message, send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True # The client went away; nothing left to tell it
+        except Exception as e:
+            if self.response_started:
+                # Too late for an error status: drop the connection so the client sees a short response
+                self.log_error("%s failed after the response was started: %r", self.path, e)
+                self.close_connection = True
+            else:
+                self.send_json_error(500, str(e), send_body)
+
+    def send_json_error(self, status, message, send_body=True):
+        try:
+            self.send(status, "application/json", json.dumps({"error": message}).encode("utf-8"), send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send(self, status, content_type, body, send_body=True, etag=None):
+        if len(body) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            encoding = "gzip"
+        else:
+            encoding = None
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache") # Cache, but revalidate (cheap: see above)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_POST(self):
+        self.send_json_error(405, "This API is read-only")
+
+    do_PUT = do_PATCH = do_DELETE = do_POST
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+def make_server(host="127.0.0.1", port=8502):
+    utils.get_connection().close() # Upgrade once here, not in whichever request threads come first
+    return ThreadingHTTPServer((host, port), ApiHandler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only JSON HTTP API over the project database.")
+    parser.add_argument("--db", default=utils.DB_FILE, help="Database (default: AUTOPM_DB or project_tracker.db)")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: local only)")
+    parser.add_argument("--port", type=int, default=8502, help="Port (default: 8502, next to Streamlit's 8501)")
+    parser.add_argument("--quiet", action="store_true", help="Do not log each request")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Database not found: {args.db}")
+        sys.exit(2)
+    utils.DB_FILE = args.db
+    utils.SNAPSHOT_ENABLED = False # The snapshot file belongs to the app; the API only reads by id anyway
+    ApiHandler.quiet = args.quiet
+
+    server = make_server(args.host, args.port)
+    print(f"Serving {args.db} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,328 @@
+"""
+Benchmark suite for the data paths in utils.
+
+Runs each benchmark against synthetic portfolios of several sizes (see
+generate_portfolio.py) and records wall time, SQL statement count and peak
+Python memory. Regressions are flagged with a non-zero exit code. By default
+only the SQL counts are compared, against the committed benchmark_baseline.json:
+they do not depend on the machine. Times and memory are compared only against
+a baseline saved on the same machine and passed with --baseline.
+
+Usage:
+    python benchmark.py                         # SQL counts against the committed benchmark_baseline.json
+    python benchmark.py --no-compare            # just print the numbers
+    python benchmark.py --sizes small,medium    # subset of sizes
+    python benchmark.py --save-baseline --baseline mine.json    # record a local baseline
+    python benchmark.py --baseline mine.json    # compare everything against it
+    python benchmark.py --only load_data,save_data
+    python benchmark.py --importtime            # what `import streamlit, utils` pulls in at startup
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import generate_portfolio
+import migrate_to_sqlite
+import utils
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, 'benchmark_baseline.json')
+
+# Modules that must not be imported before the first view needs them
+HEAVY_MODULES = ['pandas', 'numpy', 'plotly.express', 'plotly.graph_objects', 'openpyxl']
+
+# Fresh interpreter -> first render of the default view (Dashboard)
+COLD_START_SCRIPT = """
+import sys
+sys.path.insert(0, {here!r})
+import utils
+utils.BACKUP_DIR = {backup_dir!r}
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120).run()
+sys.exit(1 if at.exception else 0)
+"""
+
+# name -> generate_portfolio.generate() arguments
+SIZES = {
+    "small": dict(projects=25, modules=8, sub_modules=2),
+    "medium": dict(projects=250, modules=10, sub_modules=3),
+    "large": dict(projects=1000, modules=12, sub_modules=3),
+    "deep": dict(projects=100, modules=6, sub_modules=2, depth=5, sub_module_rate=0.5),
+}
+
+# The benchmarks below time the SQL paths; load_data_snapshot covers the snapshot
+utils.SNAPSHOT_ENABLED = False
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function does the (untimed) setup and
+    returns the zero-argument callable that is timed.
+    """
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return decorator
+
+# --- Benchmarks ---
+
+@benchmark("load_data")
+def bench_load_data():
+    return utils.load_data
+
+@benchmark("load_data_headers")
+def bench_load_headers():
+    return lambda: utils.load_data(headers_only=True)
+
+@benchmark("load_data_snapshot")
+def bench_load_snapshot():
+    utils.write_snapshot()
+    return utils.read_snapshot
+
+@benchmark("save_data")
+def bench_save_data():
+    # A typical interactive edit: one ECN changed, whole portfolio passed in
+    projects = utils.load_data()
+    target = next(m for p in projects for m in p['modules'] if m['gateways'].get('D0'))
+    counter = iter(range(10 ** 9))
+    def run():
+        target['gateways']['D0']['ecn'] = f"BENCH-{next(counter)}"
+        utils.save_data(projects)
+    return run
+
+@benchmark("calculate_rollup")
+def bench_rollup():
+    projects = utils.load_data()
+    return lambda: utils.calculate_rollup(projects)
+
+@benchmark("calculate_dashboard_stats")
+def bench_dashboard_stats():
+    projects = utils.load_data(headers_only=True)
+    return lambda: utils.calculate_dashboard_stats(projects)
+
+@benchmark("portfolio_stats")
+def bench_portfolio_stats():
+    return utils.portfolio_stats
+
+@benchmark("open_gateways")
+def bench_open_gateways():
+    # One dashboard page: overdue module gateways, any age, sorted by plan date
+    return lambda: utils.open_gateways('overdue', days=None, limit=25, offset=25)
+
+@benchmark("forecast_gateways")
+def bench_forecast():
+    return utils.forecast_gateways
+
+@benchmark("portfolio_trend")
+def bench_portfolio_trend():
+    return lambda: utils.portfolio_trend(date.today() - timedelta(days=365))
+
+@benchmark("export_changes")
+def bench_export_changes():
+    # A sync job picking up one edited module (plus its rolled-up parents)
+    projects = utils.load_data()
+    target = next(m for p in projects for m in p['modules'] if m['gateways'].get('D0'))
+    since = utils.get_change_seq()
+    target['gateways']['D0']['ecn'] = "BENCH-DELTA"
+    utils.save_data(projects)
+    return lambda: utils.export_changes(io.StringIO(), since, 'jsonl')
+
+@benchmark("process_csv_upload")
+def bench_csv_upload():
+    projects = utils.load_data()
+    csv_text = utils.projects_to_csv(projects)
+    return lambda: utils.process_csv_upload(io.StringIO(csv_text), copy.deepcopy(projects))
+
+@benchmark("projects_to_csv")
+def bench_to_csv():
+    projects = utils.load_data()
+    return lambda: utils.projects_to_csv(projects)
+
+@benchmark("projects_to_excel")
+def bench_to_excel():
+    projects = utils.load_data()
+    return lambda: utils.projects_to_excel(projects)
+
+@benchmark("cold_import")
+def bench_cold_import():
+    return lambda: subprocess.run([sys.executable, "-c", "import utils"], cwd=HERE, check=True)
+
+@benchmark("cold_start")
+def bench_cold_start():
+    script = COLD_START_SCRIPT.format(here=HERE, app=os.path.join(HERE, 'app.py'),
+                                      backup_dir=os.path.join(os.path.dirname(utils.DB_FILE), 'backups'))
+    env = dict(os.environ, AUTOPM_DB=utils.DB_FILE)
+    return lambda: subprocess.run([sys.executable, "-c", script], cwd=HERE, env=env, check=True,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# --- Import Time ---
+
+def import_time_report(statement="import utils", top=15):
+    """
+    Runs `import streamlit` plus the statement under `python -X importtime` and
+    returns (rows, heavy): the 'top' slowest imports as (cumulative ms, self ms,
+    module) and the HEAVY_MODULES the statement added on top of streamlit's own.
+    """
+    probe = (f"import sys, streamlit; before = set(sys.modules); {statement}; "
+             f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules and m not in before))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=HERE,
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, module.rstrip()))
+    rows.sort(reverse=True)
+    heavy = [m for m in proc.stdout.strip().split(",") if m]
+    return rows[:top], heavy
+
+# --- Runner ---
+
+def prepare_database(size, workdir, seed=42):
+    """Creates (once per run) the synthetic database for a size and points utils at it."""
+    path = os.path.join(workdir, f"bench_{size}_{seed}.db")
+    if not os.path.exists(path):
+        conn = sqlite3.connect(path)
+        migrate_to_sqlite.create_schema(conn)
+        generate_portfolio.generate(conn, seed=seed, **SIZES[size])
+        conn.close()
+    utils.DB_FILE = path
+    return path
+
+def measure(fn, repeats):
+    """Returns wall times (ms), SQL statements per call and peak traced memory (KiB)."""
+    fn() # Warm-up (imports, caches)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    # Query count via the instrumentation layer, on a separate call
+    saved = utils.PERF_ENABLED, utils.PERF_LOG
+    utils.PERF_ENABLED, utils.PERF_LOG = True, os.devnull
+    try:
+        with utils.perf_section("benchmark") as counters:
+            fn()
+        sql = counters['sql']
+    finally:
+        utils.PERF_ENABLED, utils.PERF_LOG = saved
+
+    # Peak memory, also on a separate call (tracemalloc slows everything down)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "sql": sql,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+def compare(results, baseline, tolerance, sql_only=False):
+    """
+    Yields (key, metric, baseline value, current value) for every regression.
+    With sql_only, time and memory (which depend on the machine) are skipped.
+    """
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if cur["sql"] > base["sql"]:
+            yield key, "sql", base["sql"], cur["sql"]
+        if sql_only:
+            continue
+        # Time: relative tolerance plus 1 ms of absolute slack for tiny benchmarks
+        if cur["median_ms"] > base["median_ms"] * (1 + tolerance) + 1.0:
+            yield key, "median_ms", base["median_ms"], cur["median_ms"]
+        if cur["peak_kib"] > base["peak_kib"] * (1 + tolerance) + 64:
+            yield key, "peak_kib", base["peak_kib"], cur["peak_kib"]
+
+def run(sizes, names, repeats):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            prepare_database(size, workdir)
+            for name in names:
+                fn = BENCHMARKS[name]()
+                res = measure(fn, repeats)
+                results[f"{name}[{size}]"] = res
+                print(f"{name + '[' + size + ']':40s} {res['median_ms']:10.2f} ms  (min {res['min_ms']:.2f})"
+                      f"  sql={res['sql']:<6d} peak={res['peak_kib']:.0f} KiB")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark load/save/rollup/status/import/export.")
+    parser.add_argument("--sizes", default="small,medium,large,deep", help=f"Comma-separated sizes: {', '.join(SIZES)}")
+    parser.add_argument("--only", default="", help="Comma-separated benchmark names (default: all)")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed calls per benchmark")
+    parser.add_argument("--baseline", help="Baseline saved on this machine: compare time and memory too / save to it "
+                                           "(default: SQL counts only, against benchmark_baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true", help="Do not compare against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before flagging")
+    parser.add_argument("--importtime", action="store_true", help="Report startup imports and exit (non-zero if heavy modules load)")
+    args = parser.parse_args()
+
+    if args.importtime:
+        rows, heavy = import_time_report()
+        print(f"{'cumulative ms':>14s} {'self ms':>9s}  module")
+        for cumulative, own, module in rows:
+            print(f"{cumulative:14.1f} {own:9.1f}  {module}")
+        if heavy:
+            print(f"REGRESSION: imported at startup: {', '.join(heavy)}")
+            sys.exit(1)
+        print(f"None of {', '.join(HEAVY_MODULES)} imported at startup.")
+        sys.exit(0)
+
+    sizes = [s for s in args.sizes.split(",") if s]
+    names = [n for n in args.only.split(",") if n] or list(BENCHMARKS)
+    unknown = [s for s in sizes if s not in SIZES] + [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown size/benchmark: {', '.join(unknown)}")
+
+    results = run(sizes, names, args.repeats)
+    baseline_file = args.baseline or BASELINE_FILE
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {baseline_file}")
+    elif not args.no_compare:
+        if not os.path.exists(baseline_file):
+            print(f"No baseline at {baseline_file} (run with --save-baseline to create one, or pass --no-compare)")
+            sys.exit(2)
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        missing = [key for key in results if key not in baseline]
+        if missing:
+            print(f"Not in the baseline (not compared): {', '.join(missing)}")
+        sql_only = args.baseline is None
+        regressions = list(compare(results, baseline, args.tolerance, sql_only))
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key}: {metric} {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline_file}" + (" (SQL counts only)." if sql_only else "."))
@@ -0,0 +1,64 @@
+"""
+Delta export for sync jobs (e.g. the PLM sync): writes only the projects and
+modules changed since a given change_seq, plus the ones deleted since, as CSV,
+JSON lines or Parquet (see utils.export_changes).
+
+With --state the last exported seq is kept in a file: the first run exports
+everything, each later run only what changed since the previous one. The
+state file is only updated once the export has been written.
+
+Usage:
+    python export_changes.py --state plm.seq --out changes.jsonl
+    python export_changes.py --since 1200 --format csv --out - > changes.csv
+    python export_changes.py --db synthetic.db --out full.parquet     # full export
+"""
+import argparse
+import os
+import sys
+
+import utils
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the entities changed since a change_seq.")
+    parser.add_argument("--db", default=utils.DB_FILE, help="Database (default: AUTOPM_DB or project_tracker.db)")
+    parser.add_argument("--since", type=int, help="Export changes after this change_seq (default: everything)")
+    parser.add_argument("--state", help="File holding the last exported change_seq; read for --since, updated after the export")
+    parser.add_argument("--format", choices=utils.DELTA_FORMATS, help="Output format (default: from --out's extension, else jsonl)")
+    parser.add_argument("--out", default="-", help="Output file ('-' for stdout, the default)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Database not found: {args.db}", file=sys.stderr)
+        sys.exit(2)
+    utils.DB_FILE = args.db
+
+    since = args.since
+    if since is None and args.state and os.path.exists(args.state):
+        with open(args.state) as f:
+            since = int(f.read().strip())
+
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.out)[1].lstrip(".").lower()
+        fmt = ext if ext in utils.DELTA_FORMATS else "jsonl"
+    if fmt == "parquet" and args.out == "-":
+        parser.error("Parquet cannot be written to stdout; use --out FILE")
+
+    if args.out == "-":
+        result = utils.export_changes(sys.stdout, since, fmt)
+    else:
+        tmp = args.out + ".tmp" # Never leave a half-written export under the real name
+        with open(tmp, "wb" if fmt == "parquet" else "w", newline="" if fmt == "csv" else None) as f:
+            result = utils.export_changes(f, since, fmt)
+        if result is None:
+            os.remove(tmp)
+        else:
+            os.replace(tmp, args.out)
+    if result is None:
+        sys.exit(1)
+
+    if args.state:
+        with open(args.state, "w") as f:
+            f.write(f"{result['seq']}\n")
+    scope = "all entities" if since is None else f"changes after seq {since}"
+    print(f"Exported {result['rows']} rows ({scope}, now at seq {result['seq']})", file=sys.stderr)
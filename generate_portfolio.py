@@ -0,0 +1,168 @@
+"""
+Synthetic portfolio generator for scale testing.
+
+Seeds a SQLite database (same schema as migrate_to_sqlite.create_schema) with
+a configurable number of projects, modules and sub-modules. Plan dates follow
+the D0 -> D4 chain, actuals are skewed against plan per project, and rollups
+are consistent with utils.calculate_rollup. The same seed always produces the
+same database.
+
+Usage:
+    python generate_portfolio.py --db synthetic.db --projects 500 --modules 12 --sub-modules 3 --seed 42
+    python generate_portfolio.py --db deep.db --depth 5 --sub-module-rate 0.5   # 5-level BOMs
+    AUTOPM_DB=synthetic.db streamlit run app.py
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import migrate_to_sqlite
+
+GATEWAYS = ['D0', 'D1', 'D2', 'D3', 'D4']
+TYPES = ['Major', 'Minor', 'Carryover']
+PART_NAMES = [
+    "Body", "Doors", "Seating", "Bumper", "Fascia", "Carpet/Insulation", "Dashboard",
+    "Lighting", "HVAC", "Wiring Harness", "Glass", "Trim", "Chassis", "Powertrain Mounts",
+    "Infotainment", "Mirrors", "Roof Module", "Console",
+]
+
+# Days between consecutive plan gateways (min, max): D0->D1, D1->D2, D2->D3, D3->D4
+PLAN_GAPS = [(30, 60), (60, 120), (60, 120), (120, 240)]
+
+# Project health profiles: (share of projects, mean slip days, slip spread)
+SLIP_PROFILES = [(0.6, -3, 4), (0.3, 12, 8), (0.1, 45, 20)]
+
+def _pick_profile(rng):
+    r = rng.random()
+    for share, mean, spread in SLIP_PROFILES:
+        if r < share:
+            return mean, spread
+        r -= share
+    return SLIP_PROFILES[-1][1:]
+
+def _plan_dates(rng, start_from, start_span_days):
+    d = start_from + timedelta(days=rng.randint(0, start_span_days))
+    plans = [d]
+    for lo, hi in PLAN_GAPS:
+        d = d + timedelta(days=rng.randint(lo, hi))
+        plans.append(d)
+    return [p.isoformat() for p in plans]
+
+def _leaf_actuals(rng, plans, fill_rate, slip_mean, slip_spread):
+    """Actuals for one leaf entity: the first k gateways of the chain are complete."""
+    done = sum(1 for _ in GATEWAYS if rng.random() < fill_rate)
+    actuals = []
+    for i, plan in enumerate(plans):
+        if i < done:
+            slip = max(-15, round(rng.gauss(slip_mean, slip_spread)))
+            actuals.append((date.fromisoformat(plan) + timedelta(days=slip)).isoformat())
+        else:
+            actuals.append('')
+    return actuals
+
+def _ecn(rng, actual, ecn_rate):
+    if actual and rng.random() < ecn_rate:
+        return f"ECN-{rng.randint(10000, 99999)}"
+    return ''
+
+def _rolled(children_actuals):
+    """Max of the children's actuals per gateway ('' when none), as calculate_rollup does."""
+    return [max([a[i] for a in children_actuals if a[i]], default='') for i in range(len(GATEWAYS))]
+
+def generate(conn, projects=100, modules=8, sub_modules=2, fill_rate=0.6, ecn_rate=0.5,
+             sub_module_rate=0.3, seed=42, start=date(2024, 1, 1), start_span_days=730, batch_size=5000,
+             depth=2):
+    """
+    Fills an empty database. Each module above level 'depth' (1 = top-level
+    modules only) gets 'sub_modules' children with probability
+    'sub_module_rate'. Returns a dict of row counts.
+    """
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA synchronous=OFF")
+
+    proj_rows, mod_rows, gw_rows = [], [], []
+    counts = {"projects": 0, "modules": 0, "gateways": 0}
+
+    def flush(force=False):
+        if force or len(gw_rows) >= batch_size:
+            migrate_to_sqlite.bulk_execute(cursor, "INSERT INTO projects (id, name, type) {rows}", proj_rows)
+            migrate_to_sqlite.bulk_execute(cursor, "INSERT INTO modules (id, project_id, name, parent_module_id) {rows}", mod_rows)
+            migrate_to_sqlite.bulk_execute(cursor, "INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) {rows}", gw_rows)
+            counts["projects"] += len(proj_rows)
+            counts["modules"] += len(mod_rows)
+            counts["gateways"] += len(gw_rows)
+            proj_rows.clear()
+            mod_rows.clear()
+            gw_rows.clear()
+
+    next_module_id = projects + 1
+    for p_id in range(1, projects + 1):
+        p_type = rng.choice(TYPES)
+        plans = _plan_dates(rng, start, start_span_days)
+        slip_mean, slip_spread = _pick_profile(rng)
+        proj_rows.append((p_id, f"Project {p_id:05d}", p_type))
+
+        def add_module(m_name, parent_id, level):
+            """Queues a module and (maybe) its subtree; returns its actuals."""
+            nonlocal next_module_id
+            m_id = next_module_id
+            next_module_id += 1
+            mod_rows.append((m_id, p_id, m_name, parent_id))
+            if level < depth and sub_modules and rng.random() < sub_module_rate:
+                acts = _rolled([add_module(f"{m_name} Part {s_idx + 1}", m_id, level + 1)
+                                for s_idx in range(sub_modules)])
+            else:
+                acts = _leaf_actuals(rng, plans, fill_rate, slip_mean, slip_spread)
+            for gw, plan, act in zip(GATEWAYS, plans, acts):
+                gw_rows.append(('module', m_id, gw, plan, act, _ecn(rng, act, ecn_rate)))
+            return acts
+
+        module_actuals = []
+        for m_idx in range(modules):
+            base = PART_NAMES[m_idx % len(PART_NAMES)]
+            m_name = base if m_idx < len(PART_NAMES) else f"{base} {m_idx // len(PART_NAMES) + 1}"
+            module_actuals.append(add_module(m_name, None, 1))
+
+        p_acts = _rolled(module_actuals) if module_actuals else [''] * len(GATEWAYS)
+        for gw, plan, act in zip(GATEWAYS, plans, p_acts):
+            gw_rows.append(('project', p_id, gw, plan, act, None))
+        flush()
+
+    flush(force=True)
+    # One committed write, like migrate_data: rows were stamped with this seq (see migrate_to_sqlite.CHANGE_TRIGGERS)
+    cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'change_seq'")
+    conn.commit()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a database with a synthetic project portfolio.")
+    parser.add_argument("--db", default="synthetic.db", help="Database file to create (default: synthetic.db)")
+    parser.add_argument("--projects", type=int, default=100, help="Number of projects")
+    parser.add_argument("--modules", type=int, default=8, help="Modules per project")
+    parser.add_argument("--sub-modules", type=int, default=2, help="Sub-modules per module that has any")
+    parser.add_argument("--sub-module-rate", type=float, default=0.3, help="Share of modules that have sub-modules")
+    parser.add_argument("--depth", type=int, default=2, help="Module tree levels (1 = no sub-modules)")
+    parser.add_argument("--fill-rate", type=float, default=0.6, help="Probability that each gateway in the D0->D4 chain has an actual")
+    parser.add_argument("--ecn-rate", type=float, default=0.5, help="Share of completed gateways that carry an ECN")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (same seed, same database)")
+    parser.add_argument("--force", action="store_true", help="Overwrite the database if it exists")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f"{args.db} already exists (use --force to overwrite)")
+        os.remove(args.db)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.db)
+    migrate_to_sqlite.create_schema(conn)
+    counts = generate(conn, projects=args.projects, modules=args.modules, sub_modules=args.sub_modules,
+                      fill_rate=args.fill_rate, ecn_rate=args.ecn_rate, sub_module_rate=args.sub_module_rate,
+                      seed=args.seed, depth=args.depth)
+    conn.close()
+    print(f"Generated {counts['projects']} projects, {counts['modules']} modules, "
+          f"{counts['gateways']} gateways in {time.perf_counter() - started:.1f}s -> {args.db}")
@@ -0,0 +1,199 @@
+"""
+Headless multi-session load test for app.py.
+
+Simulates N concurrent users with Streamlit's AppTest, one process per user
+(AppTest swaps a process-wide runtime singleton, so it cannot share a process
+with other sessions), each looping through
+typical flows (dashboard, type filtering, Gantt, opening a project and
+editing an ECN) against a synthetic database. Reports latency percentiles
+per step, time spent waiting for the SQLite write lock, busy errors, edit
+conflicts and edit flows that found nothing to edit.
+
+Usage:
+    python loadtest.py --sessions 30 --iterations 5
+    python loadtest.py --db synthetic.db --sessions 10   # reuse an existing database
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import generate_portfolio
+import migrate_to_sqlite
+import utils
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+class Session:
+    """One simulated user: an AppTest instance plus its own random choices."""
+
+    def __init__(self, number, seed, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.number = number
+        self.rng = random.Random(seed * 1000 + number)
+        self.at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+        self.timings = [] # (step, ms)
+        self.errors = []
+        self.conflicts = 0
+        self.edits = 0
+        self.skipped = [] # Edit flows that did not get as far as an ECN input
+
+    def _timed(self, step, action):
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self.errors.append(f"{step}: {e}")
+            return
+        self.timings.append((step, (time.perf_counter() - start) * 1000))
+        if self.at.exception:
+            self.errors.extend(f"{step}: {e.value}" for e in self.at.exception)
+        self.conflicts += sum(1 for e in self.at.error if "not saved" in str(e.value))
+
+    def _nav(self, label):
+        button = next(b for b in self.at.button if label in b.label)
+        button.click().run()
+
+    def dashboard(self):
+        self._timed("dashboard", lambda: self._nav("Dashboard"))
+
+    def filter_types(self):
+        ms = next((m for m in self.at.multiselect if m.key == "dash_filter_types"), None)
+        if ms is None or not ms.options:
+            return
+        choice = self.rng.sample(list(ms.options), self.rng.randint(1, len(ms.options)))
+        self._timed("filter", lambda: ms.set_value(choice).run())
+
+    def gantt(self):
+        self._timed("gantt", lambda: self._nav("Gantt View"))
+
+    def edit(self):
+        self.edits += 1
+        self._timed("detail_view", lambda: self._nav("Detailed Project View"))
+        pager = next((n for n in self.at.number_input if n.key == "dpv_page"), None)
+        if pager is not None:
+            page = self.rng.randint(pager.min, pager.max)
+            self._timed("page", lambda: pager.set_value(page).run())
+        # Only the current page's projects have expanders to open
+        ids = sorted(self.at.session_state["visible_projects"]) if "visible_projects" in self.at.session_state else []
+        if not ids:
+            self.skipped.append("no projects rendered")
+            return
+        p_id = self.rng.choice(ids)
+        def open_project():
+            self.at.session_state[f"exp_{p_id}"] = True
+            self.at.run()
+        self._timed("open_project", open_project)
+        ecn_inputs = [t for t in self.at.text_input if t.key and t.key.endswith("_ecn")]
+        if not ecn_inputs:
+            self.skipped.append(f"project {p_id}: no ECN inputs after opening")
+            return
+        target = self.rng.choice(ecn_inputs)
+        value = f"LT-{self.number}-{self.rng.randint(0, 99999)}"
+        self._timed("edit_ecn", lambda: target.set_value(value).run())
+
+    def run(self, iterations):
+        self._timed("first_load", self.at.run)
+        for _ in range(iterations):
+            for flow in self.rng.sample([self.dashboard, self.filter_types, self.gantt, self.edit], 4):
+                flow()
+
+def run_session(job):
+    """Worker process entry point: one simulated user."""
+    number, opts = job
+    # The app imports this same utils module, so these settings apply to the session
+    utils.DB_FILE = opts["db"]
+    utils.BACKUP_DIR = opts["backup_dir"]
+    utils.PERF_ENABLED, utils.PERF_LOG = True, opts["perf_log"]
+    session = Session(number, opts["seed"], opts["timeout"])
+    session.run(opts["iterations"])
+    return {"timings": session.timings, "errors": session.errors, "conflicts": session.conflicts,
+            "edits": session.edits, "skipped": session.skipped}
+
+def percentiles(values):
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    qs = statistics.quantiles(values, n=100, method='inclusive')
+    return qs[49], qs[89], qs[98]
+
+def summarize_perf_log(path):
+    """Totals of the top-level instrumentation sections (nested ones are already included)."""
+    totals = {"lock_wait_ms": 0.0, "busy_errors": 0, "save_calls": 0}
+    if not os.path.exists(path):
+        return totals
+    with open(path) as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec.get("event") != "section":
+                continue
+            if rec.get("name") == "save_data":
+                totals["save_calls"] += 1
+            if rec.get("depth") == 0:
+                totals["lock_wait_ms"] += rec.get("lock_wait_ms", 0)
+                totals["busy_errors"] += rec.get("busy_errors", 0)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the Streamlit app.")
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=3, help="Flow loops per user")
+    parser.add_argument("--db", help="Existing database to copy and test against (default: generate one)")
+    parser.add_argument("--projects", type=int, default=100, help="Projects in the generated database")
+    parser.add_argument("--modules", type=int, default=8, help="Modules per project in the generated database")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for data generation and user behaviour")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed per app run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="autopm_loadtest_")
+    db_path = os.path.join(workdir, "loadtest.db")
+    if args.db:
+        shutil.copy(args.db, db_path) # Never write to the caller's database
+    else:
+        conn = sqlite3.connect(db_path)
+        migrate_to_sqlite.create_schema(conn)
+        generate_portfolio.generate(conn, projects=args.projects, modules=args.modules, seed=args.seed)
+        conn.close()
+
+    perf_log = os.path.join(workdir, "perf.jsonl")
+    opts = {"db": db_path, "backup_dir": os.path.join(workdir, "backups"), "perf_log": perf_log,
+            "seed": args.seed, "timeout": args.timeout, "iterations": args.iterations}
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes=args.sessions) as pool:
+        sessions = pool.map(run_session, [(i, opts) for i in range(args.sessions)])
+    wall = time.perf_counter() - started
+
+    by_step = {}
+    for s in sessions:
+        for step, ms in s["timings"]:
+            by_step.setdefault(step, []).append(ms)
+
+    print(f"\n{args.sessions} sessions x {args.iterations} iterations in {wall:.1f}s")
+    print(f"{'step':15s} {'n':>6s} {'p50 ms':>10s} {'p90 ms':>10s} {'p99 ms':>10s} {'max ms':>10s}")
+    for step, values in sorted(by_step.items()):
+        p50, p90, p99 = percentiles(values)
+        print(f"{step:15s} {len(values):6d} {p50:10.1f} {p90:10.1f} {p99:10.1f} {max(values):10.1f}")
+
+    db_totals = summarize_perf_log(perf_log)
+    errors = [e for s in sessions for e in s["errors"]]
+    print(f"\nsave_data calls: {db_totals['save_calls']}")
+    print(f"write lock wait: {db_totals['lock_wait_ms']:.1f} ms total")
+    print(f"SQLite busy errors: {db_totals['busy_errors']}")
+    print(f"edit conflicts shown: {sum(s['conflicts'] for s in sessions)}")
+    skipped = [e for s in sessions for e in s["skipped"]]
+    print(f"edit flows skipped: {len(skipped)} of {sum(s['edits'] for s in sessions)}")
+    for e in skipped[:10]:
+        print(f"  {e}")
+    print(f"script errors: {len(errors)}")
+    for e in errors[:10]:
+        print(f"  {e}")
+    print(f"\nArtifacts (database, perf log): {workdir}")
+
+if __name__ == "__main__":
+    main()
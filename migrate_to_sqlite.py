@@ -1,10 +1,32 @@
-import sqlite3
+"""
+Schema management and the JSON -> SQLite import.
+
+The import streams the legacy projects.json export one project at a time and
+writes it in batched transactions, so memory stays flat regardless of file
+size. Progress is recorded in the database with each batch: an interrupted
+run picks up where it stopped, and by default an existing database is
+merged into (rows are inserted or updated by id) rather than replaced.
+
+Usage:
+    python migrate_to_sqlite.py                      # merge projects.json into project_tracker.db
+    python migrate_to_sqlite.py --json export.json --db other.db
+    python migrate_to_sqlite.py --fresh              # delete the database first (old behaviour)
+"""
+import argparse
+import codecs
 import json
 import os
+import re
+import sqlite3
+import time
+import zlib
 
 DB_FILE = "project_tracker.db"
 JSON_FILE = "projects.json"
 
+BATCH_ROWS = 50000 # Gateway rows per import transaction (also how far a resumed import may repeat)
+READ_SIZE = 1 << 20 # Bytes read from the JSON file at a time
+
 def create_schema(conn):
     cursor = conn.cursor()
     
@@ -13,7 +35,9 @@ def create_schema(conn):
     CREATE TABLE IF NOT EXISTS projects (
         id INTEGER PRIMARY KEY,
         name TEXT,
-        type TEXT
+        type TEXT,
+        version INTEGER NOT NULL DEFAULT 1,
+        modules_rev INTEGER NOT NULL DEFAULT 0
     )
     ''')
     
@@ -24,6 +48,7 @@ def create_schema(conn):
         project_id INTEGER,
         name TEXT,
         parent_module_id INTEGER,
+        version INTEGER NOT NULL DEFAULT 1,
         FOREIGN KEY(project_id) REFERENCES projects(id),
         FOREIGN KEY(parent_module_id) REFERENCES modules(id)
     )
@@ -39,68 +64,612 @@ def create_schema(conn):
         gateway TEXT,
         plan_date TEXT,
         actual_date TEXT,
-        ecn TEXT
+        ecn TEXT,
+        version INTEGER NOT NULL DEFAULT 1
     )
     ''')
     
+    upgrade_schema(conn)
     conn.commit()
 
-def migrate_data(conn):
-    if not os.path.exists(JSON_FILE):
-        print("No JSON file found to migrate.")
+def upgrade_schema(conn):
+    """
+    Brings databases created by older versions up to the current schema.
+    Safe to run repeatedly, also from several connections at once: it only
+    adds what is missing, checked under a write lock. The caller commits.
+    """
+    cursor = conn.cursor()
+
+    # WAL lets readers keep going while another session commits its edits.
+    # (Must run outside a transaction, i.e. before the row inserts below.)
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # A concurrent upgrade holds the lock until it commits; everything below then finds its work done
+    if not conn.in_transaction:
+        cursor.execute("BEGIN IMMEDIATE")
+
+    added_columns = [
+        # Row versions for optimistic concurrency (see utils.save_data)
+        ('projects', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+        ('modules', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+        ('gateways', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+        # Bumped whenever anything below the project changes (see utils.ModuleCache)
+        ('projects', 'modules_rev', 'INTEGER NOT NULL DEFAULT 0'),
+        # change_seq of the last commit that changed the entity or its gateways (see CHANGE_TRIGGERS)
+        ('projects', 'modified_seq', 'INTEGER NOT NULL DEFAULT 0'),
+        ('modules', 'modified_seq', 'INTEGER NOT NULL DEFAULT 0'),
+    ]
+    for table, column, decl in added_columns:
+        cols = [r[1] for r in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in cols:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    # Lookup paths used by load/save
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_modules_project ON modules(project_id, parent_module_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gateways_entity ON gateways(entity_type, entity_id, gateway)")
+    # Open gateways (no actual yet) by plan date, for the upcoming/overdue queries (see utils.open_gateways)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gateways_open_plan ON gateways(entity_type, plan_date) WHERE IFNULL(actual_date, '') = ''")
+
+    # Change counter, bumped by every committed write (see utils.write_transaction)
+    cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('change_seq', 0)")
+    # Identifies this database file (e.g. to tell a rebuilt DB from the one a snapshot was taken of)
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('db_uid', abs(random()))")
+
+    # Next free id per table for new projects/modules, handed out in blocks (see utils.allocate_ids)
+    cursor.execute("CREATE TABLE IF NOT EXISTS id_sequences (name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)")
+    for table in ('projects', 'modules'):
+        cursor.execute(f"INSERT OR IGNORE INTO id_sequences (name, next_id) SELECT '{table}', IFNULL(MAX(id), 0) + 1 FROM {table}")
+
+    # Dashboard KPIs per project, kept current by the write path (see utils.refresh_portfolio_stats)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS portfolio_stats (
+        project_id INTEGER PRIMARY KEY,
+        name TEXT,
+        type TEXT,
+        status TEXT NOT NULL,
+        mod_green INTEGER NOT NULL DEFAULT 0,
+        mod_yellow INTEGER NOT NULL DEFAULT 0,
+        mod_red INTEGER NOT NULL DEFAULT 0,
+        on_time INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        slip INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_portfolio_stats_type ON portfolio_stats(type, project_id)")
+    if 'slip' not in [r[1] for r in cursor.execute("PRAGMA table_info(portfolio_stats)")]:
+        cursor.execute("ALTER TABLE portfolio_stats ADD COLUMN slip INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("DELETE FROM portfolio_stats") # Refilled on first use (utils._ensure_portfolio_stats)
+
+    create_search_index(cursor)
+    create_history(cursor)
+    create_change_tracking(cursor)
+
+# Full-text index over project names, module names and ECNs (see utils.search).
+# One row per entity; the rowid encodes which one (id * 3 + kind code), so the
+# triggers below can replace or drop an entity's row without a scan
+# (kind codes: 0 project, 1 module, 2 ECN). Rows are deleted before being
+# (re)inserted rather than using OR REPLACE: an outer statement's conflict
+# clause (e.g. an upsert) would override the trigger's.
+SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS search_projects_ai AFTER INSERT ON projects BEGIN
+        DELETE FROM search_index WHERE rowid = new.id * 3;
+        INSERT INTO search_index (rowid, body, kind, entity_id) VALUES (new.id * 3, new.name, 'project', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_projects_au AFTER UPDATE OF name ON projects WHEN old.name IS NOT new.name BEGIN
+        DELETE FROM search_index WHERE rowid = new.id * 3;
+        INSERT INTO search_index (rowid, body, kind, entity_id) VALUES (new.id * 3, new.name, 'project', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_projects_ad AFTER DELETE ON projects BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 3;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_modules_ai AFTER INSERT ON modules BEGIN
+        DELETE FROM search_index WHERE rowid = new.id * 3 + 1;
+        INSERT INTO search_index (rowid, body, kind, entity_id) VALUES (new.id * 3 + 1, new.name, 'module', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_modules_au AFTER UPDATE OF name ON modules WHEN old.name IS NOT new.name BEGIN
+        DELETE FROM search_index WHERE rowid = new.id * 3 + 1;
+        INSERT INTO search_index (rowid, body, kind, entity_id) VALUES (new.id * 3 + 1, new.name, 'module', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_modules_ad AFTER DELETE ON modules BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 3 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_gateways_ai AFTER INSERT ON gateways WHEN new.ecn <> '' BEGIN
+        DELETE FROM search_index WHERE rowid = new.id * 3 + 2;
+        INSERT INTO search_index (rowid, body, kind, entity_id) VALUES (new.id * 3 + 2, new.ecn, 'ecn', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_gateways_au AFTER UPDATE OF ecn ON gateways WHEN old.ecn IS NOT new.ecn BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 3 + 2;
+        INSERT INTO search_index (rowid, body, kind, entity_id) SELECT new.id * 3 + 2, new.ecn, 'ecn', new.id WHERE new.ecn <> '';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_gateways_ad AFTER DELETE ON gateways WHEN old.ecn <> '' BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 3 + 2;
+    END""",
+]
+
+def create_search_index(cursor):
+    """
+    Creates search_index (FTS5, trigram tokenizer for substring matches) with
+    its triggers, and fills it from the existing rows the first time.
+    Returns False when this SQLite build has no FTS5/trigram support; search
+    then falls back to LIKE queries on the tables.
+    """
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name='search_index'").fetchone()
+    if not exists:
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE search_index USING fts5(
+                    body, kind UNINDEXED, entity_id UNINDEXED, tokenize='trigram')""")
+        except sqlite3.OperationalError:
+            return False
+    for statement in SEARCH_TRIGGERS:
+        cursor.execute(statement)
+    if not exists:
+        _fill_search_index(cursor)
+    return True
+
+def _fill_search_index(cursor):
+    cursor.execute("INSERT INTO search_index (rowid, body, kind, entity_id) SELECT id * 3, name, 'project', id FROM projects")
+    cursor.execute("INSERT INTO search_index (rowid, body, kind, entity_id) SELECT id * 3 + 1, name, 'module', id FROM modules")
+    cursor.execute("INSERT INTO search_index (rowid, body, kind, entity_id) SELECT id * 3 + 2, ecn, 'ecn', id FROM gateways WHERE ecn <> ''")
+
+# --- History ---
+# gateway_history is a change log of gateway dates, written by the triggers
+# below: one row per inserted, updated or deleted gateway. Updates are delta
+# encoded: plan_date, actual_date and status hold the new value only when it
+# changed (NULL = unchanged). portfolio_daily holds one row per day and
+# project type with the KPI counts at the end of that day (see
+# utils.record_daily_snapshot); days without writes have no rows.
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')"
+
+def _status_sql(row):
+    """SQL for utils.get_status of the gateway 'row' (old/new in a trigger)."""
+    diff = f"julianday({row}.actual_date) - julianday({row}.plan_date)"
+    return (f"CASE WHEN {diff} <= 0 THEN 'green' WHEN {diff} <= 30 THEN 'yellow' "
+            f"WHEN {diff} > 30 THEN 'red' ELSE 'grey' END")
+
+def _if_changed(new, old):
+    return f"CASE WHEN {new} IS NOT {old} THEN {new} END"
+
+HISTORY_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS history_gateways_ai AFTER INSERT ON gateways BEGIN
+        INSERT INTO gateway_history (changed_at, op, entity_type, entity_id, gateway, plan_date, actual_date, status)
+        VALUES ({_NOW}, 'I', new.entity_type, new.entity_id, new.gateway,
+                IFNULL(new.plan_date, ''), IFNULL(new.actual_date, ''), {_status_sql('new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS history_gateways_au AFTER UPDATE OF plan_date, actual_date ON gateways
+        WHEN IFNULL(old.plan_date, '') <> IFNULL(new.plan_date, '') OR IFNULL(old.actual_date, '') <> IFNULL(new.actual_date, '') BEGIN
+        INSERT INTO gateway_history (changed_at, op, entity_type, entity_id, gateway, plan_date, actual_date, status)
+        VALUES ({_NOW}, 'U', new.entity_type, new.entity_id, new.gateway,
+                {_if_changed("IFNULL(new.plan_date, '')", "IFNULL(old.plan_date, '')")},
+                {_if_changed("IFNULL(new.actual_date, '')", "IFNULL(old.actual_date, '')")},
+                {_if_changed(_status_sql('new'), _status_sql('old'))});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS history_gateways_ad AFTER DELETE ON gateways BEGIN
+        INSERT INTO gateway_history (changed_at, op, entity_type, entity_id, gateway)
+        VALUES ({_NOW}, 'D', old.entity_type, old.entity_id, old.gateway);
+    END""",
+]
+
+def create_history(cursor):
+    """
+    Creates gateway_history (with its triggers) and portfolio_daily. The
+    first time, every existing gateway is logged as inserted now, so the
+    log starts from the current state.
+    """
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name='gateway_history'").fetchone()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS gateway_history (
+        id INTEGER PRIMARY KEY,
+        changed_at TEXT NOT NULL,
+        op TEXT NOT NULL, -- 'I'nsert, 'U'pdate, 'D'elete
+        entity_type TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        gateway TEXT NOT NULL,
+        plan_date TEXT,
+        actual_date TEXT,
+        status TEXT
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gateway_history_entity ON gateway_history(entity_type, entity_id, changed_at)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS portfolio_daily (
+        day TEXT NOT NULL,
+        type TEXT NOT NULL,
+        projects INTEGER NOT NULL,
+        green INTEGER NOT NULL,
+        yellow INTEGER NOT NULL,
+        red INTEGER NOT NULL,
+        mod_green INTEGER NOT NULL,
+        mod_yellow INTEGER NOT NULL,
+        mod_red INTEGER NOT NULL,
+        on_time INTEGER NOT NULL,
+        completed INTEGER NOT NULL,
+        slip INTEGER NOT NULL,
+        PRIMARY KEY (day, type)
+    ) WITHOUT ROWID
+    ''')
+    for statement in HISTORY_TRIGGERS:
+        cursor.execute(statement)
+    if not exists:
+        _log_unlogged_gateways(cursor)
+
+def _log_unlogged_gateways(cursor):
+    """Logs every gateway that has no history yet as inserted now."""
+    cursor.execute(f"""
+        INSERT INTO gateway_history (changed_at, op, entity_type, entity_id, gateway, plan_date, actual_date, status)
+        SELECT {_NOW}, 'I', entity_type, entity_id, gateway, IFNULL(plan_date, ''), IFNULL(actual_date, ''),
+               {_status_sql('gateways')}
+        FROM gateways
+        WHERE NOT EXISTS (SELECT 1 FROM gateway_history h WHERE h.entity_type = gateways.entity_type
+                          AND h.entity_id = gateways.entity_id AND h.gateway = gateways.gateway)""")
+
+# --- Change Tracking ---
+# Every project and module row carries modified_seq: the change_seq of the
+# commit that last changed the entity itself or one of its gateways. Writers
+# bump change_seq once per commit (utils.write_transaction, migrate_data), so
+# inside a write transaction the commit's seq is change_seq + 1. Deleted
+# entities leave a row in deleted_entities. Together they let
+# utils.export_changes emit only what changed after a given change_seq.
+
+_NEXT_SEQ = "(SELECT value + 1 FROM meta WHERE key = 'change_seq')"
+
+def _stamp(table, id_expr, condition=""):
+    # The modified_seq condition skips the page write for rows already stamped in this commit
+    return (f"UPDATE {table} SET modified_seq = {_NEXT_SEQ} "
+            f"WHERE id = {id_expr} AND modified_seq IS NOT {_NEXT_SEQ}{condition};")
+
+def _gateway_owner_stamp(row):
+    """Stamps the project or module that owns the gateway 'row' (old/new in a trigger)."""
+    statements = [_stamp(f"{entity}s", f"{row}.entity_id", f" AND {row}.entity_type = '{entity}'")
+                  for entity in ('project', 'module')]
+    return "\n        ".join(statements)
+
+CHANGE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS changes_projects_ai AFTER INSERT ON projects BEGIN
+        {_stamp('projects', 'new.id')}
+        DELETE FROM deleted_entities WHERE entity_type = 'project' AND entity_id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_projects_au AFTER UPDATE OF name, type ON projects
+        WHEN old.name IS NOT new.name OR old.type IS NOT new.type BEGIN
+        {_stamp('projects', 'new.id')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_projects_ad AFTER DELETE ON projects BEGIN
+        DELETE FROM deleted_entities WHERE entity_type = 'project' AND entity_id = old.id;
+        INSERT INTO deleted_entities (entity_type, entity_id, project_id, deleted_seq)
+        VALUES ('project', old.id, old.id, {_NEXT_SEQ});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_modules_ai AFTER INSERT ON modules BEGIN
+        {_stamp('modules', 'new.id')}
+        DELETE FROM deleted_entities WHERE entity_type = 'module' AND entity_id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_modules_au AFTER UPDATE OF name, project_id, parent_module_id ON modules
+        WHEN old.name IS NOT new.name OR old.project_id IS NOT new.project_id
+          OR old.parent_module_id IS NOT new.parent_module_id BEGIN
+        {_stamp('modules', 'new.id')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_modules_ad AFTER DELETE ON modules BEGIN
+        DELETE FROM deleted_entities WHERE entity_type = 'module' AND entity_id = old.id;
+        INSERT INTO deleted_entities (entity_type, entity_id, project_id, deleted_seq)
+        VALUES ('module', old.id, old.project_id, {_NEXT_SEQ});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_gateways_ai AFTER INSERT ON gateways BEGIN
+        {_gateway_owner_stamp('new')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_gateways_au AFTER UPDATE OF plan_date, actual_date, ecn ON gateways
+        WHEN old.plan_date IS NOT new.plan_date OR old.actual_date IS NOT new.actual_date OR old.ecn IS NOT new.ecn BEGIN
+        {_gateway_owner_stamp('new')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS changes_gateways_ad AFTER DELETE ON gateways BEGIN
+        {_gateway_owner_stamp('old')}
+    END""",
+]
+
+def create_change_tracking(cursor):
+    """Creates deleted_entities, the modified_seq indexes and the triggers that maintain both."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS deleted_entities (
+        entity_type TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        project_id INTEGER,
+        deleted_seq INTEGER NOT NULL,
+        PRIMARY KEY (entity_type, entity_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deleted_entities_seq ON deleted_entities(deleted_seq)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_modified ON projects(modified_seq)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_modules_modified ON modules(modified_seq)")
+    for statement in CHANGE_TRIGGERS:
+        cursor.execute(statement)
+
+# --- JSON Import ---
+
+_WHITESPACE = re.compile(r'[ \t\n\r\ufeff]*') # \ufeff: byte order mark
+_DELIMITER = re.compile(r'[ \t\n\r,\]]')
+
+def iter_json_array(f, offset=0):
+    """
+    Yields (item, end_offset) for each element of the top-level JSON array in
+    the binary file 'f', reading it in chunks. end_offset is the byte offset
+    just past the item; passing it back as 'offset' continues after it.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    f.seek(offset)
+    # buf[:mark] is already counted in base (the byte offset of buf[mark])
+    buf, pos, mark, base, eof = "", 0, 0, offset, False
+    read_size = READ_SIZE
+    state = 'start' if offset == 0 else 'separator'
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf) or state == 'retry':
+            if eof:
+                raise ValueError(f"Unexpected end of JSON data at byte {base}")
+            chunk = f.read(read_size)
+            eof = not chunk
+            # Drop what was consumed only now, not after every item (that would copy the buffer each time)
+            buf = buf[mark:] + utf8.decode(chunk, final=eof)
+            pos -= mark
+            mark = 0
+            if state == 'retry':
+                state = 'item'
+            continue
+
+        ch = buf[pos]
+        if state == 'start':
+            if ch != '[':
+                raise ValueError("Expected a JSON array of projects")
+            pos += 1
+            state = 'first'
+        elif state == 'first' and ch == ']' or state == 'separator' and ch == ']':
+            return
+        elif state == 'separator':
+            if ch != ',':
+                raise ValueError(f"Expected ',' or ']' after byte {base}")
+            pos += 1
+            state = 'item'
+        elif ch not in '{["' and not eof and not _DELIMITER.search(buf, pos):
+            state = 'retry' # A number (or literal) may continue in the next chunk
+        else:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Item continues past the buffer; read more (growing, so huge items stay linear)
+                read_size = min(read_size * 2, 64 * READ_SIZE)
+                state = 'retry'
+                continue
+            base += len(buf[mark:end].encode('utf-8'))
+            pos = mark = end
+            read_size = READ_SIZE
+            state = 'separator'
+            yield item, base
+
+def _source_fingerprint(path):
+    """Identifies a JSON file (size and checksum of its ends), so a resume never continues a different file."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        crc = zlib.crc32(f.read(65536))
+        f.seek(max(0, size - 65536))
+        crc = zlib.crc32(f.read(), crc)
+    return (size << 32) | crc
+
+def _normalize_project(p):
+    """Legacy shapes to the in-app structure: plan-only project gateways become dicts, odd module gateways are dropped."""
+    p['gateways'] = {gw: data if isinstance(data, dict) else {'p': data or '', 'a': ''}
+                     for gw, data in (p.get('gateways') or {}).items()}
+    p.setdefault('modules', [])
+    stack = list(p['modules'])
+    while stack:
+        m = stack.pop()
+        m['gateways'] = {gw: data for gw, data in (m.get('gateways') or {}).items() if isinstance(data, dict)}
+        m.setdefault('sub_modules', [])
+        stack.extend(m['sub_modules'])
+
+def _project_rows(p, proj_rows, mod_rows, gw_rows):
+    """Appends the rows for one (normalized, rolled-up) project."""
+    proj_rows.append((p['id'], p['name'], p.get('type', '')))
+    for gw, data in p['gateways'].items():
+        if data.get('p') or data.get('a'):
+            gw_rows.append(('project', p['id'], gw, data.get('p', '') or '', data.get('a', '') or '', ''))
+    # Parents before children, at any depth
+    stack = [(m, None) for m in reversed(p['modules'])]
+    while stack:
+        m, parent_id = stack.pop()
+        mod_rows.append((m['id'], p['id'], m['name'], parent_id))
+        for gw, data in m['gateways'].items():
+            gw_rows.append(('module', m['id'], gw, data.get('p', '') or '', data.get('a', '') or '', data.get('ecn', '') or ''))
+        stack.extend((s, m['id']) for s in reversed(m['sub_modules']))
+
+def bulk_execute(cursor, statement, rows):
+    """
+    Runs 'statement' for all 'rows' as one statement: '{rows}' in it becomes
+    a SELECT over the rows, passed in as a single JSON parameter. Unlike
+    executemany this keeps the search_index triggers to one FTS flush per
+    batch instead of one per row.
+    """
+    if not rows:
         return
+    columns = ", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(rows[0])))
+    cursor.execute(statement.format(rows=f"SELECT {columns} FROM json_each(?) WHERE true"), (json.dumps(rows),))
+
+# Plain inserts for an empty database; upserts by id wherever a row may already exist (see migrate_data)
+_INSERT_SQL = {
+    'projects': "INSERT INTO projects (id, name, type) {rows}",
+    'modules': "INSERT INTO modules (id, project_id, name, parent_module_id) {rows}",
+    'gateways': "INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) {rows}",
+}
+_MERGE_SQL = {
+    # Row versions only move when something changed; modules_rev always does (see utils.ModuleCache)
+    'projects': """
+        INSERT INTO projects (id, name, type) {rows}
+        ON CONFLICT(id) DO UPDATE SET name=excluded.name, type=excluded.type,
+            version = version + (name IS NOT excluded.name OR type IS NOT excluded.type),
+            modules_rev = modules_rev + 1""",
+    'modules': """
+        INSERT INTO modules (id, project_id, name, parent_module_id) {rows}
+        ON CONFLICT(id) DO UPDATE SET project_id=excluded.project_id, name=excluded.name,
+            parent_module_id=excluded.parent_module_id,
+            version = version + (project_id IS NOT excluded.project_id OR name IS NOT excluded.name
+                                 OR parent_module_id IS NOT excluded.parent_module_id)""",
+    # Gateways have no unique key: rows that exist and differ are updated, the rest inserted.
+    # NULL and '' are the same empty value (the app writes both)
+    'gateways_update': """
+        UPDATE gateways SET plan_date=?, actual_date=?, ecn=?, version=version+1
+        WHERE entity_type=? AND entity_id=? AND gateway=?
+          AND (IFNULL(plan_date, '') IS NOT ? OR IFNULL(actual_date, '') IS NOT ? OR IFNULL(ecn, '') IS NOT ?)""",
+}
+
+# Maintained row by row by triggers during normal use. A fresh load drops them
+# and builds their tables in one pass at the end (see _rebuild_after_load);
+# meta.json_migrate_rebuild records that this is still owed, across restarts.
+LOAD_TRIGGERS = [re.search(r"CREATE TRIGGER IF NOT EXISTS (\w+)", statement).group(1)
+                 for statement in SEARCH_TRIGGERS + HISTORY_TRIGGERS + CHANGE_TRIGGERS]
+
+def _rebuild_after_load(cursor):
+    """
+    Recreates LOAD_TRIGGERS and fills in what they would have written: the
+    search index, the history of gateways loaded without it, and modified_seq
+    (every row counts as changed by this commit, which bumps change_seq).
+    """
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name='search_index'").fetchone():
+        cursor.execute("DELETE FROM search_index")
+        _fill_search_index(cursor)
+    create_search_index(cursor)
+    _log_unlogged_gateways(cursor)
+    create_history(cursor)
+    for table in ('projects', 'modules'):
+        cursor.execute(f"UPDATE {table} SET modified_seq = {_NEXT_SEQ}")
+    create_change_tracking(cursor)
+
+_PROGRESS_KEYS = ('json_migrate_source', 'json_migrate_offset', 'json_migrate_items')
+
+def migrate_data(conn, json_file=JSON_FILE, merge=True, resume=True, batch_rows=BATCH_ROWS):
+    """
+    Streams 'json_file' (a JSON array of projects) into the database.
+
+    Rows are written in bulk (see bulk_execute) in transactions of about
+    'batch_rows' gateway rows. Each commit also records how far into the file it got, so
+    with 'resume' an interrupted import of the same file continues after the
+    last committed batch. With 'merge' rows are inserted or updated by id
+    (nothing is deleted); without it they are plain inserts into an empty
+    database, with the search/history/change triggers dropped until the end
+    (see LOAD_TRIGGERS). A resumed load upserts, since its first batch may
+    already be in. Derived actuals are rolled up as the app does, and the
+    touched projects' portfolio_stats rows are refreshed.
+    Returns a dict of counts, or None when there is no file.
+    """
+    import utils # utils imports this module, so not at the top
+
+    if not os.path.exists(json_file):
+        print("No JSON file found to migrate.")
+        return None
 
-    with open(JSON_FILE, 'r') as f:
-        projects = json.load(f)
-        
     cursor = conn.cursor()
-    
-    for p in projects:
-        print(f"Migrating Project: {p['name']}")
-        cursor.execute("INSERT OR REPLACE INTO projects (id, name, type) VALUES (?, ?, ?)", 
-                       (p['id'], p['name'], p.get('type', '')))
-        
-        # Project Gateways
-        for gw, date in p.get('gateways', {}).items():
-            if date:
-                cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date) VALUES (?, ?, ?, ?)",
-                               ('project', p['id'], gw, date))
-        
-        # Modules
-        if 'modules' in p:
-            for m in p['modules']:
-                print(f"  - Module: {m['name']}")
-                cursor.execute("INSERT OR REPLACE INTO modules (id, project_id, name) VALUES (?, ?, ?)",
-                               (m['id'], p['id'], m['name']))
-                
-                # Module Gateways
-                for gw, data in m.get('gateways', {}).items():
-                    # Check if data is dict (v3 standard) or just date (legacy check)
-                    if isinstance(data, dict):
-                        cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) VALUES (?, ?, ?, ?, ?, ?)",
-                                       ('module', m['id'], gw, data.get('p', ''), data.get('a', ''), data.get('ecn', '')))
-                
-                # Sub-Modules
-                if 'sub_modules' in m:
-                    for s in m['sub_modules']:
-                        print(f"    - Sub-Module: {s['name']}")
-                        cursor.execute("INSERT OR REPLACE INTO modules (id, project_id, name, parent_module_id) VALUES (?, ?, ?, ?)",
-                                       (s['id'], p['id'], s['name'], m['id']))
-                        
-                        # Sub-Module Gateways
-                        for gw, data in s.get('gateways', {}).items():
-                            if isinstance(data, dict):
-                                cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) VALUES (?, ?, ?, ?, ?, ?)",
-                                               ('module', s['id'], gw, data.get('p', ''), data.get('a', ''), data.get('ecn', '')))
+    stats_cursor = conn.cursor()
+    stats_cursor.row_factory = sqlite3.Row # What utils.refresh_portfolio_stats expects
+    # Bulk-load settings: WAL (set by upgrade_schema) with NORMAL sync cannot corrupt on a crash,
+    # it only loses the last commit, which a resume repeats
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+
+    source = _source_fingerprint(json_file)
+    offset, done = 0, 0
+    if resume:
+        progress = dict(cursor.execute(f"SELECT key, value FROM meta WHERE key IN ({', '.join('?' * len(_PROGRESS_KEYS))})",
+                                       _PROGRESS_KEYS).fetchall())
+        if progress.get('json_migrate_source') == source:
+            offset, done = progress['json_migrate_offset'], progress['json_migrate_items']
+            print(f"Resuming {json_file} after {done} projects (byte {offset})")
+
+    rebuild = not merge or cursor.execute("SELECT 1 FROM meta WHERE key = 'json_migrate_rebuild'").fetchone()
+    if rebuild:
+        # Same transaction as the flag (the INSERT opens it), so the triggers never go missing unnoticed
+        cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrate_rebuild', 1)")
+        for name in LOAD_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.commit()
+    merge = merge or offset > 0
+    sql = _MERGE_SQL if merge else _INSERT_SQL
+    counts = {"projects": 0, "modules": 0, "gateways": 0}
+    started = time.perf_counter()
+    proj_rows, mod_rows, gw_rows = [], [], []
+
+    def flush(end_offset):
+        bulk_execute(cursor, sql['projects'], proj_rows)
+        bulk_execute(cursor, sql['modules'], mod_rows)
+        if merge:
+            # Split into new, changed and unchanged rows with one lookup per batch
+            existing = {}
+            for entity_type, ids in (('project', [r[0] for r in proj_rows]), ('module', [r[0] for r in mod_rows])):
+                for r in cursor.execute("""
+                        SELECT entity_id, gateway, IFNULL(plan_date, ''), IFNULL(actual_date, ''), IFNULL(ecn, '') FROM gateways
+                        WHERE entity_type=? AND entity_id IN (SELECT value FROM json_each(?))""",
+                        (entity_type, json.dumps(ids))):
+                    existing[(entity_type, r[0], r[1])] = r[2:]
+            changed = [(*r[3:], *r[:3], *r[3:]) for r in gw_rows if r[:3] in existing and existing[r[:3]] != r[3:]]
+            cursor.executemany(sql['gateways_update'], changed)
+            bulk_execute(cursor, _INSERT_SQL['gateways'], [r for r in gw_rows if r[:3] not in existing])
+        else:
+            bulk_execute(cursor, sql['gateways'], gw_rows)
+        utils.refresh_portfolio_stats(stats_cursor, [r[0] for r in proj_rows])
+        cursor.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           zip(_PROGRESS_KEYS, (source, end_offset, done)))
+        # Running apps key their caches on this (see utils.get_change_seq)
+        cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'change_seq'")
+        conn.commit()
+        counts["projects"] += len(proj_rows)
+        counts["modules"] += len(mod_rows)
+        counts["gateways"] += len(gw_rows)
+        elapsed = time.perf_counter() - started
+        print(f"  {done} projects, {end_offset / 1e6:.0f} MB ({(end_offset - offset) / 1e6 / max(elapsed, 1e-9):.0f} MB/s)")
+        proj_rows.clear()
+        mod_rows.clear()
+        gw_rows.clear()
 
+    end_offset = offset
+    with open(json_file, 'rb') as f:
+        for p, end_offset in iter_json_array(f, offset):
+            _normalize_project(p)
+            utils.calculate_rollup([p])
+            _project_rows(p, proj_rows, mod_rows, gw_rows)
+            done += 1
+            if len(gw_rows) >= batch_rows:
+                flush(end_offset)
+    if proj_rows:
+        flush(end_offset)
+
+    # Finished: the next run of this file is a full merge again
+    if rebuild:
+        rebuild_started = time.perf_counter()
+        _rebuild_after_load(cursor)
+        cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'change_seq'")
+        cursor.execute("DELETE FROM meta WHERE key = 'json_migrate_rebuild'")
+        print(f"  search index, history and change tracking rebuilt in {time.perf_counter() - rebuild_started:.1f}s")
+    cursor.execute(f"DELETE FROM meta WHERE key IN ({', '.join('?' * len(_PROGRESS_KEYS))})", _PROGRESS_KEYS)
     conn.commit()
-    print("Migration Complete.")
+    print(f"Migration Complete: {counts['projects']} projects, {counts['modules']} modules, "
+          f"{counts['gateways']} gateways in {time.perf_counter() - started:.1f}s")
+    return counts
 
 if __name__ == "__main__":
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE) # Clean start for baseline
-    
-    conn = sqlite3.connect(DB_FILE)
+    parser = argparse.ArgumentParser(description="Import a projects.json export into the SQLite database.")
+    parser.add_argument("--db", default=DB_FILE, help=f"Database file (default: {DB_FILE})")
+    parser.add_argument("--json", default=JSON_FILE, help=f"JSON export to import (default: {JSON_FILE})")
+    parser.add_argument("--fresh", action="store_true", help="Delete the database first instead of merging into it")
+    parser.add_argument("--no-resume", action="store_true", help="Start from the beginning of the file even if an earlier import was interrupted")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Gateway rows per transaction")
+    args = parser.parse_args()
+
+    if args.fresh:
+        for path in (args.db, args.db + "-wal", args.db + "-shm"):
+            if os.path.exists(path):
+                os.remove(path) # Clean start for baseline
+
+    conn = sqlite3.connect(args.db)
     create_schema(conn)
-    migrate_data(conn)
+    migrate_data(conn, args.json, merge=not args.fresh, resume=not args.no_resume, batch_rows=args.batch_rows)
     conn.close()
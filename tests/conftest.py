@@ -0,0 +1,45 @@
+"""
+Shared fixtures. Every test works on its own database in a temporary
+directory; the repository's project_tracker.db is only ever copied.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate_portfolio  # noqa: E402
+import migrate_to_sqlite  # noqa: E402
+import utils  # noqa: E402
+
+def use_database(monkeypatch, tmp_path, path):
+    """Points utils at 'path' for the rest of the test, with backups under tmp_path and no snapshot file."""
+    monkeypatch.setattr(utils, "DB_FILE", str(path))
+    monkeypatch.setattr(utils, "BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(utils, "SNAPSHOT_ENABLED", False)
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A small synthetic portfolio (some modules with sub-modules), selected as utils.DB_FILE."""
+    path = str(tmp_path / "portfolio.db")
+    conn = sqlite3.connect(path)
+    migrate_to_sqlite.create_schema(conn)
+    generate_portfolio.generate(conn, projects=20, modules=4, sub_modules=2, sub_module_rate=0.5, seed=7)
+    conn.close()
+    use_database(monkeypatch, tmp_path, path)
+    return path
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """A copy of the shipped project_tracker.db, still on the schema before any upgrade."""
+    path = str(tmp_path / "legacy.db")
+    shutil.copy(os.path.join(ROOT, "project_tracker.db"), path)
+    use_database(monkeypatch, tmp_path, path)
+    return path
@@ -0,0 +1,59 @@
+"""api.py over a real socket: ETags, 304 and paging."""
+import http.client
+import json
+import threading
+
+import pytest
+
+import api
+import utils
+
+@pytest.fixture
+def server(db, monkeypatch):
+    monkeypatch.setattr(api.ApiHandler, "quiet", True)
+    httpd = api.make_server("127.0.0.1", 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+def request(port, path, method="GET", **headers):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request(method, path, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.getheader("ETag"), response.read()
+    finally:
+        conn.close()
+
+def test_unchanged_database_answers_304(server, monkeypatch):
+    status, etag, body = request(server, "/projects?fields=id,name&limit=5")
+    assert status == 200 and etag
+    assert [p['id'] for p in json.loads(body)['items']] == [1, 2, 3, 4, 5]
+
+    # A matching tag is answered before anything is loaded
+    def no_loading(*args, **kwargs):
+        raise AssertionError("loaded data for a 304")
+    monkeypatch.setattr(utils, "load_data", no_loading)
+    assert request(server, "/projects?fields=id,name&limit=5", **{"If-None-Match": etag}) == (304, etag, b"")
+    assert request(server, "/projects/3", **{"If-None-Match": f'"other", W/{etag}'})[0] == 304
+
+def test_save_changes_the_etag(server):
+    status, etag, _ = request(server, "/projects/1")
+    assert status == 200
+
+    projects = utils.load_data(project_ids=[1])
+    projects[0]['modules'][0]['gateways']['D0']['ecn'] = "API-1"
+    assert utils.save_data(projects)
+
+    status, new_etag, body = request(server, "/projects/1", **{"If-None-Match": etag})
+    assert status == 200 and new_etag != etag
+    assert json.loads(body)['modules'][0]['gateways']['D0']['ecn'] == "API-1"
+    assert request(server, "/projects/1", **{"If-None-Match": new_etag})[0] == 304
+
+def test_head_and_errors(server):
+    status, etag, body = request(server, "/projects/2", method="HEAD")
+    assert status == 200 and etag and body == b""
+    assert request(server, "/projects/999999")[0] == 404
+    assert request(server, "/projects?offset=-1")[0] == 400
@@ -0,0 +1,62 @@
+"""export_changes: full and delta exports keyed on change_seq."""
+import csv
+import io
+import json
+
+import utils
+
+def export(since, fmt='jsonl'):
+    out = io.StringIO()
+    result = utils.export_changes(out, since, fmt)
+    if fmt == 'jsonl':
+        return result, [json.loads(line) for line in out.getvalue().splitlines()]
+    return result, list(csv.DictReader(io.StringIO(out.getvalue())))
+
+def test_full_export_has_every_entity(db):
+    result, rows = export(None)
+    conn = utils.get_connection()
+    entities = conn.execute("SELECT (SELECT COUNT(*) FROM projects) + (SELECT COUNT(*) FROM modules)").fetchone()[0]
+    conn.close()
+    assert result['rows'] == len(rows) == entities
+    assert {r['op'] for r in rows} == {'upsert'}
+
+def test_delta_has_only_what_changed(db):
+    since = export(None)[0]['seq']
+    assert export(since)[0]['rows'] == 0
+
+    projects = utils.load_data(project_ids=[5])
+    leaf = next(m for m, parent, _ in utils.walk_modules(projects[0]['modules']) if parent is not None and not m.get('sub_modules'))
+    leaf['gateways']['D1']['ecn'] = "DELTA-1"
+    assert utils.save_data(projects)
+
+    result, rows = export(since)
+    assert result['seq'] > since
+    assert {r['project_id'] for r in rows} == {5}
+    assert [r['D1_ECN'] for r in rows if r['entity_type'] == 'module' and r['entity_id'] == leaf['id']] == ["DELTA-1"]
+    # The same delta as CSV
+    assert export(since, 'csv')[0]['rows'] == result['rows']
+
+    # Nothing new since the delta just taken
+    assert export(result['seq'])[0]['rows'] == 0
+
+def test_delta_reports_deleted_modules(db):
+    since = export(None)[0]['seq']
+    projects = utils.load_data(project_ids=[7])
+    module = projects[0]['modules'][0]
+    subtree = {m['id'] for m, _, _ in utils.walk_modules([module])}
+    assert utils.delete_module(module['id'], module['version'])
+
+    rows = export(since)[1]
+    assert {r['entity_id'] for r in rows if r['op'] == 'delete'} == subtree
+    assert all(r['entity_type'] == 'module' for r in rows if r['op'] == 'delete')
+    # The project only when the delete changed its rolled-up actuals
+    assert {(r['entity_type'], r['entity_id']) for r in rows if r['op'] == 'upsert'} <= {('project', 7)}
+
+def test_write_outside_the_app_shows_up_in_the_next_delta(db):
+    since = export(None)[0]['seq']
+    conn = utils.get_connection()
+    conn.execute("UPDATE modules SET name = 'Renamed Elsewhere' WHERE id = (SELECT MIN(id) FROM modules)")
+    conn.commit()
+    conn.close()
+    rows = export(since)[1]
+    assert [r['name'] for r in rows] == ["Renamed Elsewhere"]
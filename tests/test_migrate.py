@@ -0,0 +1,154 @@
+"""Schema upgrade and the streaming JSON import."""
+import json
+import random
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+import migrate_to_sqlite
+import utils
+from conftest import ROOT
+
+def write_export(path, count=30, seed=5):
+    """A projects.json in the legacy format: plain project plan dates, modules with nested sub_modules."""
+    rng = random.Random(seed)
+    ids = iter(range(1000, 10 ** 6))
+
+    def gateways():
+        result = {}
+        for i, gw in enumerate(utils.GATEWAYS):
+            plan = f"2025-{i + 1:02d}-{rng.randint(10, 28)}"
+            actual = rng.choice(["", f"2025-{i + 1:02d}-{rng.randint(10, 28)}"])
+            result[gw] = {"p": plan, "a": actual, "ecn": f"ECN-{rng.randint(1, 9999)}" if actual else ""}
+        return result
+
+    projects = []
+    for p_id in range(1, count + 1):
+        modules = []
+        for k in range(4):
+            subs = [{"id": next(ids), "name": f"Part {s}", "gateways": gateways()} for s in range(rng.randint(0, 2))]
+            modules.append({"id": next(ids), "name": f"Module {k}", "gateways": gateways(), "sub_modules": subs})
+        projects.append({"id": p_id, "name": f"Project {p_id}", "type": rng.choice(["Major", "Minor"]),
+                         "gateways": {gw: f"2025-{i + 1:02d}-15" for i, gw in enumerate(utils.GATEWAYS)},
+                         "modules": modules})
+    with open(path, "w") as f:
+        json.dump(projects, f, indent=4)
+
+def contents(path):
+    """Everything an import writes that later reads depend on, in a comparable form."""
+    conn = sqlite3.connect(path)
+    try:
+        queries = {
+            "projects": "SELECT id, name, type FROM projects ORDER BY id",
+            "modules": "SELECT id, project_id, name, parent_module_id FROM modules ORDER BY id",
+            "gateways": "SELECT entity_type, entity_id, gateway, plan_date, actual_date, ecn FROM gateways ORDER BY 1, 2, 3",
+            "search": "SELECT kind, entity_id, body FROM search_index ORDER BY 1, 2",
+            "triggers": "SELECT name FROM sqlite_master WHERE type='trigger' ORDER BY name",
+            "progress": "SELECT key FROM meta WHERE key LIKE 'json_migrate%'",
+        }
+        return {name: conn.execute(sql).fetchall() for name, sql in queries.items()}
+    finally:
+        conn.close()
+
+def test_interrupted_import_resumes_to_the_same_data(tmp_path, monkeypatch):
+    export = str(tmp_path / "projects.json")
+    write_export(export)
+
+    clean = str(tmp_path / "clean.db")
+    conn = sqlite3.connect(clean)
+    migrate_to_sqlite.create_schema(conn)
+    migrate_to_sqlite.migrate_data(conn, export, merge=False, batch_rows=100)
+    conn.close()
+    expected = contents(clean)
+    assert len(expected["projects"]) == 30 and expected["triggers"] and not expected["progress"]
+
+    # A fresh load that dies on its third batch
+    resumed = str(tmp_path / "resumed.db")
+    conn = sqlite3.connect(resumed)
+    migrate_to_sqlite.create_schema(conn)
+    batches = []
+    bulk_execute = migrate_to_sqlite.bulk_execute
+    def failing(cursor, statement, rows):
+        if "INTO projects" in statement:
+            batches.append(len(rows))
+            if len(batches) == 3:
+                raise KeyboardInterrupt
+        return bulk_execute(cursor, statement, rows)
+    with monkeypatch.context() as m:
+        m.setattr(migrate_to_sqlite, "bulk_execute", failing)
+        with pytest.raises(KeyboardInterrupt):
+            migrate_to_sqlite.migrate_data(conn, export, merge=False, batch_rows=100)
+    conn.close()
+    partial = contents(resumed)
+    assert 0 < len(partial["projects"]) < 30
+    assert partial["progress"]
+
+    # Rerun as the command line does without --fresh: merge, resuming after the last committed batch
+    conn = sqlite3.connect(resumed)
+    migrate_to_sqlite.create_schema(conn)
+    assert migrate_to_sqlite.migrate_data(conn, export, batch_rows=100)["projects"] == 30 - sum(batches[:2])
+    conn.close()
+    assert contents(resumed) == expected
+
+def test_reimport_merges_without_duplicates(tmp_path):
+    export = str(tmp_path / "projects.json")
+    write_export(export)
+    path = str(tmp_path / "merge.db")
+    conn = sqlite3.connect(path)
+    migrate_to_sqlite.create_schema(conn)
+    migrate_to_sqlite.migrate_data(conn, export, merge=False, batch_rows=100)
+    first = contents(path)
+    migrate_to_sqlite.migrate_data(conn, export, batch_rows=100)
+    conn.close()
+    assert contents(path) == first
+
+def test_concurrent_first_connections_upgrade_once(legacy_db, tmp_path, monkeypatch):
+    # The race is timing dependent, so a few rounds, each on a database this process has not upgraded yet
+    for round_ in range(5):
+        path = str(tmp_path / f"legacy_{round_}.db")
+        shutil.copy(f"{ROOT}/project_tracker.db", path)
+        monkeypatch.setattr(utils, "DB_FILE", path)
+        barrier = threading.Barrier(8)
+        errors, sizes = [], []
+
+        def first_load():
+            barrier.wait()
+            try:
+                sizes.append(len(utils.load_data()))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=first_load) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert len(sizes) == 8 and len(set(sizes)) == 1 and sizes[0] > 0
+
+def test_upgrade_from_two_connections_at_once(legacy_db):
+    # Two processes opening the same old database: each upgrades on its own connection
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def upgrade():
+        conn = sqlite3.connect(legacy_db, timeout=30)
+        try:
+            barrier.wait()
+            migrate_to_sqlite.create_schema(conn)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=upgrade) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    conn = sqlite3.connect(legacy_db)
+    assert "version" in [r[1] for r in conn.execute("PRAGMA table_info(modules)")]
+    conn.close()
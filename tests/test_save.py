@@ -0,0 +1,83 @@
+"""save_data: optimistic concurrency, rollups and CSV-created rows."""
+import io
+
+import pytest
+
+import utils
+
+def first_leaf(project):
+    return next(m for m, _, _ in utils.walk_modules(project['modules']) if not m.get('sub_modules'))
+
+def test_second_conflicting_save_raises(db):
+    first = utils.load_data(project_ids=[1])
+    second = utils.load_data(project_ids=[1])
+
+    first_leaf(first[0])['gateways']['D0']['ecn'] = "FIRST"
+    assert utils.save_data(first)
+
+    first_leaf(second[0])['gateways']['D0']['ecn'] = "SECOND"
+    with pytest.raises(utils.ConcurrentEditError) as excinfo:
+        utils.save_data(second)
+    assert excinfo.value.conflicts
+
+    # Nothing of the losing save was written
+    assert first_leaf(utils.load_data(project_ids=[1])[0])['gateways']['D0']['ecn'] == "FIRST"
+
+def test_save_after_reload_does_not_conflict(db):
+    first = utils.load_data(project_ids=[1])
+    first_leaf(first[0])['gateways']['D0']['ecn'] = "FIRST"
+    assert utils.save_data(first)
+
+    # The winner's session keeps editing on the versions its save stamped
+    first_leaf(first[0])['gateways']['D0']['ecn'] = "FIRST AGAIN"
+    assert utils.save_data(first)
+
+def test_parallel_leaf_edits_both_roll_up_to_project(db):
+    projects = utils.load_data()
+    p, parent = next((p, m) for p in projects for m in p['modules'] if len(m.get('sub_modules', [])) >= 2)
+    leaf_a, leaf_b = parent['sub_modules'][:2]
+
+    # Two sessions, each setting a late D4 actual on a different leaf of the same module
+    session_a = utils.load_data(project_ids=[p['id']])
+    session_b = utils.load_data(project_ids=[p['id']])
+    find = lambda session, m_id: next(m for m, _, _ in utils.walk_modules(session[0]['modules']) if m['id'] == m_id)
+    find(session_a, leaf_a['id'])['gateways']['D4']['a'] = "2099-01-01"
+    assert utils.save_data(session_a)
+    find(session_b, leaf_b['id'])['gateways']['D4']['a'] = "2099-02-01"
+    assert utils.save_data(session_b)
+
+    fresh = utils.load_data(project_ids=[p['id']])[0]
+    assert find([fresh], leaf_a['id'])['gateways']['D4']['a'] == "2099-01-01"
+    assert find([fresh], parent['id'])['gateways']['D4']['a'] == "2099-02-01"
+    assert fresh['gateways']['D4']['a'] == "2099-02-01"
+
+def test_csv_upload_allocates_unique_ids(db):
+    rows = ["Project Name,Type,Module Name,Parent Module,P_D0,D0_Act"]
+    for p in range(3):
+        for m in range(5):
+            rows.append(f"CSV {p},Major,Mod {m},,2025-01-01,")
+            rows.append(f"CSV {p},Major,Part {m},Mod {m},2025-01-01,2025-01-02")
+    projects = utils.load_data()
+    existing = {m['id'] for p in projects for m, _, _ in utils.walk_modules(p['modules'])}
+
+    updated, message = utils.process_csv_upload(io.StringIO("\n".join(rows)), projects)
+    assert message == "Success"
+    new = [p for p in updated if p['name'].startswith("CSV ")]
+    ids = [m['id'] for p in new for m, _, _ in utils.walk_modules(p['modules'])]
+    assert len(new) == 3
+    assert len(ids) == 30 and len(set(ids)) == 30
+    assert not set(ids) & existing
+
+    assert utils.save_data(updated)
+    saved = utils.load_data(project_ids=[p['id'] for p in new])
+    assert sorted(m['id'] for p in saved for m, _, _ in utils.walk_modules(p['modules'])) == sorted(ids)
+    # Sub-module actuals rolled up to the new modules
+    assert all(m['gateways']['D0']['a'] == "2025-01-02" for p in saved for m in p['modules'])
+    assert utils.allocate_ids('modules')[0] > max(ids)
+
+def test_failed_csv_upload_adds_nothing(db):
+    projects = utils.load_data()
+    before = [p['id'] for p in projects]
+    updated, message = utils.process_csv_upload(io.StringIO("Project Name,Type\n\"unterminated,Major\n"), projects)
+    assert message.startswith("Error")
+    assert [p['id'] for p in updated] == before
@@ -0,0 +1,60 @@
+"""utils.search: the FTS5 trigram index, its LIKE fallback for short words, and trigger upkeep."""
+import sqlite3
+
+import pytest
+
+import utils
+
+def expected_hits(query):
+    """(kind, id) of every project, module and ECN containing all words of 'query', by brute force."""
+    terms = query.lower().split()
+    conn = sqlite3.connect(utils.DB_FILE)
+    try:
+        texts = [('project', i, t) for i, t in conn.execute("SELECT id, name FROM projects")]
+        texts += [('module', i, t) for i, t in conn.execute("SELECT id, name FROM modules")]
+        texts += [('ecn', i, t) for i, t in conn.execute("SELECT id, ecn FROM gateways WHERE ecn <> ''")]
+    finally:
+        conn.close()
+    return {(kind, i) for kind, i, text in texts if all(term in text.lower() for term in terms)}
+
+def found(query):
+    return {(h['kind'], h['id']) for h in utils.search(query, limit=100000)}
+
+# Words of three characters or more go through the index; shorter ones through LIKE
+@pytest.mark.parametrize("query", ["Doors", "door part 2", "ECN-1", "Project 0001", "Seat", "ar", "Bu", "2"])
+def test_search_matches_substrings(db, query):
+    assert found(query) == expected_hits(query)
+
+def test_search_without_fts_table_falls_back_to_like(db):
+    conn = sqlite3.connect(db)
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'search%'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("DROP TABLE search_index")
+    conn.commit()
+    conn.close()
+    for query in ("Doors", "ar"):
+        assert found(query) == expected_hits(query)
+
+def test_search_treats_wildcards_literally(db):
+    projects = utils.load_data(project_ids=[2])
+    projects[0]['modules'][0]['name'] = "100% Electric_Drive"
+    assert utils.save_data(projects)
+    for query in ("100%", "c_D", "%"):
+        assert found(query) == expected_hits(query)
+
+def test_index_follows_edits_and_deletes(db):
+    projects = utils.load_data(project_ids=[3])
+    module = projects[0]['modules'][0]
+    module['name'] = "Zebrafish Housing"
+    module['gateways']['D1']['ecn'] = "QQX-777"
+    assert utils.save_data(projects)
+
+    assert [(h['kind'], h['id']) for h in utils.search("zebrafish hous")] == [('module', module['id'])]
+    assert [(h['kind'], h['module'], h['gateway']) for h in utils.search("QQX-777")] == [('ecn', "Zebrafish Housing", 'D1')]
+
+    module['gateways']['D1']['ecn'] = ""
+    assert utils.save_data(projects)
+    assert utils.search("QQX-777") == []
+
+    assert utils.delete_module(module['id'], module['version'])
+    assert utils.search("zebrafish") == []
@@ -1,164 +1,1466 @@
+import csv
 import json
 import os
+import sys
 import sqlite3
-import pandas as pd
-from datetime import datetime
-import random
-import shutil
+from datetime import date, datetime, timedelta
 import glob
+import mmap
+import pickle
+import struct
+import functools
+import itertools
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import migrate_to_sqlite
+# pandas/numpy (and openpyxl, via pandas) are imported inside the functions
+# that build tables or exports, so they stay off the startup path.
 
-DB_FILE = os.path.join(os.path.dirname(__file__), 'project_tracker.db')
+# AUTOPM_DB points the app at another database (e.g. one made by generate_portfolio.py)
+DB_FILE = os.environ.get('AUTOPM_DB') or os.path.join(os.path.dirname(__file__), 'project_tracker.db')
 BACKUP_DIR = os.path.join(os.path.dirname(__file__), 'backups')
-from datetime import datetime
+GATEWAYS = ['D0', 'D1', 'D2', 'D3', 'D4']
 
-def load_data():
-    """Loads projects from the SQLite database and reconstructs the nested dictionary."""
+_schema_ready = set()
+_schema_lock = threading.Lock() # First connections of concurrent threads (sessions, snapshot worker, API) upgrade once
+
+# --- Performance Instrumentation ---
+# Enable with AUTOPM_PERF=1. Every timed section is written as one JSON line
+# to AUTOPM_PERF_LOG (a file path), or to stderr if that is not set.
+PERF_ENABLED = os.environ.get('AUTOPM_PERF', '0').lower() not in ('', '0', 'false', 'no')
+PERF_LOG = os.environ.get('AUTOPM_PERF_LOG')
+
+_perf_local = threading.local()
+_perf_lock = threading.Lock()
+_perf_run_ids = itertools.count(1)
+
+def _perf_emit(record):
+    line = json.dumps(record, default=str)
+    with _perf_lock:
+        if PERF_LOG:
+            with open(PERF_LOG, 'a') as f:
+                f.write(line + "\n")
+        else:
+            print(line, file=sys.stderr)
+
+def _perf_stack():
+    if not hasattr(_perf_local, 'stack'):
+        _perf_local.stack = []
+    return _perf_local.stack
+
+@contextmanager
+def perf_section(name):
+    """
+    Times a block and collects the counters (SQL statements, rows, ...) recorded
+    inside it. Nested sections add their counters to the enclosing one.
+    No-op unless PERF_ENABLED.
+    """
+    if not PERF_ENABLED:
+        yield None
+        return
+    stack = _perf_stack()
+    counters = {'sql': 0, 'rows': 0}
+    stack.append(counters)
+    run = getattr(_perf_local, 'run', None)
+    if run is not None:
+        slot = len(run["records"]) # Keep records in the order sections started
+        run["records"].append(None)
+    start = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        stack.pop()
+        if stack:
+            for k, v in counters.items():
+                stack[-1][k] = stack[-1].get(k, 0) + v
+        record = {"event": "section", "name": name, "ms": round(elapsed, 3), "depth": len(stack),
+                  **{k: round(v, 3) if isinstance(v, float) else v for k, v in counters.items()}}
+        if run is not None:
+            record["run"] = run["id"]
+            run["records"][slot] = record
+        _perf_emit(dict(record, ts=datetime.now().isoformat(timespec='milliseconds')))
+
+def timed(name=None):
+    """Decorator form of perf_section; the section is named after the function by default."""
+    def decorator(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PERF_ENABLED:
+                return fn(*args, **kwargs)
+            with perf_section(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def perf_count(counter, n=1):
+    """Adds n to a counter of the innermost active section."""
+    if PERF_ENABLED:
+        stack = _perf_stack()
+        if stack:
+            stack[-1][counter] = stack[-1].get(counter, 0) + n
+
+def perf_begin_run(label="rerun"):
+    """Starts collecting the sections of one script run (e.g. one Streamlit rerun) on this thread."""
+    if PERF_ENABLED:
+        _perf_local.run = {"id": next(_perf_run_ids), "label": label, "start": time.perf_counter(), "records": []}
+
+def perf_end_run():
+    """Finishes the current run, emits a summary line and returns its section records."""
+    run = getattr(_perf_local, 'run', None)
+    if not PERF_ENABLED or run is None:
+        return []
+    _perf_local.run = None
+    run["records"] = [r for r in run["records"] if r is not None]
+    total = (time.perf_counter() - run["start"]) * 1000
+    _perf_emit({"event": "run", "run": run["id"], "label": run["label"], "ms": round(total, 3),
+                "sections": len(run["records"]), "ts": datetime.now().isoformat(timespec='milliseconds')})
+    return run["records"]
+
+def _perf_sql(statement):
+    perf_count('sql')
+
+# --- Memory Profiling ---
+# Enable with AUTOPM_MEMPROF=1. tracemalloc snapshots are taken around the
+# profiled sections (load_data, rollups, each view); every section is written
+# as one JSON line to AUTOPM_MEMPROF_LOG (default: memprof.jsonl next to this
+# file). tracemalloc is process-wide, so sections of concurrent sessions
+# overlap; profile with a single session open for clean numbers.
+MEMPROF_ENABLED = os.environ.get('AUTOPM_MEMPROF', '0').lower() not in ('', '0', 'false', 'no')
+MEMPROF_LOG = os.environ.get('AUTOPM_MEMPROF_LOG') or os.path.join(os.path.dirname(__file__), 'memprof.jsonl')
+MEMPROF_TOP = 10 # Allocation sites reported per section
+
+_mem_local = threading.local()
+
+if MEMPROF_ENABLED and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+def peak_rss_kib():
+    """Peak resident set size of this process in KiB (None where unsupported, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak # bytes on macOS, KiB on Linux
+
+def _mem_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+@contextmanager
+def mem_section(name):
+    """
+    Records the net allocations, traced peak and top allocation sites of a
+    block. Nested sections are reported separately (the outer one includes them).
+    No-op unless MEMPROF_ENABLED.
+    """
+    if not MEMPROF_ENABLED or not tracemalloc.is_tracing():
+        yield
+        return
+    if not hasattr(_mem_local, 'stack'):
+        _mem_local.stack = []
+    stack = _mem_local.stack
+    if stack:
+        # reset_peak() below would lose the enclosing section's peak so far
+        stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+    frame = {'peak': 0}
+    stack.append(frame)
+    before = _mem_snapshot()
+    start_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(frame['peak'], peak)
+        stack.pop()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        stats = _mem_snapshot().compare_to(before, 'lineno')
+        top = [{"site": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                "kib": round(s.size_diff / 1024, 1), "count": s.count_diff}
+               for s in sorted(stats, key=lambda s: s.size_diff, reverse=True)[:MEMPROF_TOP] if s.size_diff > 0]
+        record = {"event": "mem", "name": name, "depth": len(stack),
+                  "alloc_kib": round((current - start_size) / 1024, 1),
+                  "peak_kib": round((peak - start_size) / 1024, 1),
+                  "rss_peak_kib": peak_rss_kib(), "top": top}
+        run = getattr(_mem_local, 'run', None)
+        if run is not None:
+            record["run"] = run["id"]
+            run["records"].append(record)
+        line = json.dumps(dict(record, ts=datetime.now().isoformat(timespec='milliseconds')))
+        with _perf_lock:
+            with open(MEMPROF_LOG, 'a') as f:
+                f.write(line + "\n")
+
+def mem_profiled(name=None):
+    """Decorator form of mem_section; the section is named after the function by default."""
+    def decorator(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not MEMPROF_ENABLED:
+                return fn(*args, **kwargs)
+            with mem_section(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def mem_begin_run():
+    """Starts collecting the memory sections of one script run on this thread."""
+    if MEMPROF_ENABLED:
+        _mem_local.run = {"id": next(_perf_run_ids), "records": []}
+
+def mem_end_run():
+    """Finishes the current run and returns its memory records (outermost sections last)."""
+    run = getattr(_mem_local, 'run', None)
+    if not MEMPROF_ENABLED or run is None:
+        return []
+    _mem_local.run = None
+    return run["records"]
+
+class ConcurrentEditError(Exception):
+    """
+    Raised by the write path when rows this session changed were modified
+    by someone else since they were loaded.
+    'conflicts' is a list of dicts describing each clashing row.
+    """
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__(f"{len(conflicts)} conflicting edit(s)")
+
+def get_connection():
+    """Opens a connection to DB_FILE, upgrading the schema once per process."""
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if PERF_ENABLED:
+        conn.set_trace_callback(_perf_sql)
+    if DB_FILE not in _schema_ready:
+        with _schema_lock:
+            if DB_FILE not in _schema_ready: # Another thread may have finished it while we waited
+                migrate_to_sqlite.create_schema(conn)
+                _ensure_portfolio_stats(conn)
+                _schema_ready.add(DB_FILE)
+    return conn
+
+@contextmanager
+def write_transaction():
+    """
+    Short IMMEDIATE transaction for the write path.
+    Only the rows a save actually touches are written, so sessions editing
+    different modules do not serialize on a full-table rewrite.
+    """
+    conn = get_connection()
+    conn.isolation_level = None # We issue BEGIN/COMMIT ourselves
+    try:
+        # Time spent waiting for the write lock (other sessions committing)
+        waiting = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        finally:
+            perf_count('lock_wait_ms', (time.perf_counter() - waiting) * 1000)
+        changes_before = conn.total_changes
+        _tx_local.changed, _tx_local.last_seq = set(), None
+        yield conn.cursor()
+        changed = conn.total_changes > changes_before
+        if changed:
+            # Readers key their caches on this (see get_change_seq)
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'change_seq'")
+            seq = conn.execute("SELECT value FROM meta WHERE key = 'change_seq'").fetchone()[0]
+        conn.execute("COMMIT")
+        if changed:
+            _tx_local.last_seq = seq
+            # Nothing marked: some write path that does not report its entities, so "anything"
+            CHANGES.publish(DB_FILE, seq, frozenset(_tx_local.changed) or None)
+            schedule_snapshot()
+    except BaseException as e:
+        if isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e)):
+            perf_count('busy_errors')
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        _tx_local.changed = None
+        conn.close()
+
+def get_change_seq():
+    """
+    Number of committed writes so far. Cheap to read, so views can key cached
+    data on it and only recompute after something was actually saved.
+    """
+    if not os.path.exists(DB_FILE):
+        return 0
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'change_seq'").fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+ID_SEQUENCES = ('projects', 'modules')
+
+def allocate_ids(table, count=1):
+    """
+    Reserves 'count' consecutive ids for new rows of 'table' (one of
+    ID_SEQUENCES) and returns them as a range. One short transaction per
+    call however many ids, and concurrent callers always get disjoint
+    blocks. Blocks start above the table's largest id, so rows inserted
+    with explicit ids (imports, generate_portfolio.py) are never handed out
+    again. Reserving ids is not a data change: change_seq is left alone.
+    """
+    if table not in ID_SEQUENCES:
+        raise ValueError(f"No id sequence for {table!r}")
+    if count <= 0:
+        return range(0)
+    conn = get_connection()
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        first = conn.execute(f"""
+            SELECT MAX(IFNULL((SELECT next_id FROM id_sequences WHERE name = ?), 1),
+                       IFNULL((SELECT MAX(id) FROM {table}), 0) + 1)""", (table,)).fetchone()[0]
+        conn.execute("""
+            INSERT INTO id_sequences (name, next_id) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET next_id = excluded.next_id""", (table, first + count))
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return range(first, first + count)
+
+# --- Change Notifications ---
+# Every commit made through write_transaction is published on CHANGES, a
+# process-wide feed of (change_seq, changed entities). A session remembers
+# the change_seq it has seen and asks changes_since() what changed after it,
+# so it can refresh just those projects instead of reloading everything.
+# Commits the feed did not see (another process, or older than the feed)
+# are reported as None: "unknown, reload everything".
+
+_tx_local = threading.local()
+
+class ChangeBus:
+    """
+    Bounded, thread-safe log of the commits made in this process, per
+    database file: change_seq -> frozenset of ('project', id) / ('module', id)
+    pairs, or None when the writer did not say what it changed.
+    """
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._logs = {} # db_file -> deque of (seq, entities)
+
+    def publish(self, db_file, seq, entities):
+        with self._lock:
+            self._logs.setdefault(db_file, deque(maxlen=self.max_entries)).append((seq, entities))
+
+    def entities_between(self, db_file, after, upto, skip=()):
+        """
+        Entities changed by the commits after 'after' up to 'upto' (change_seqs),
+        leaving out the commits in 'skip'. None if any commit in that range is
+        not in the log or did not report its entities.
+        """
+        with self._lock:
+            entries = {seq: entities for seq, entities in self._logs.get(db_file, ())
+                       if after < seq <= upto}
+        changed = set()
+        for seq in range(after + 1, upto + 1):
+            if seq in skip:
+                continue
+            entities = entries.get(seq)
+            if entities is None:
+                return None
+            changed |= entities
+        return changed
+
+CHANGES = ChangeBus()
+
+def mark_changed(cursor, project_ids, deleted_modules=()):
+    """
+    Records the projects (and all their modules, plus 'deleted_modules' that
+    are no longer in the table) as changed by the current write_transaction,
+    for its CHANGES entry. No-op outside a transaction.
+    """
+    pending = getattr(_tx_local, 'changed', None)
+    if pending is None:
+        return
+    ids = list(project_ids)
+    pending.update(('project', p_id) for p_id in ids)
+    pending.update(('module', m_id) for m_id in deleted_modules)
+    pending.update(('module', r[0]) for r in cursor.execute(
+        "SELECT id FROM modules WHERE project_id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)))
+
+def last_written_seq():
+    """change_seq of the last commit made by this thread through write_transaction (None if none)."""
+    return getattr(_tx_local, 'last_seq', None)
+
+def changes_since(seq, skip=()):
+    """
+    (current change_seq, entities changed since 'seq'), ignoring the commits
+    in 'skip' (e.g. the caller's own). Entities is an empty set when nothing
+    changed and None when the changes are unknown (reload everything).
+    """
+    current = get_change_seq()
+    if current == seq:
+        return current, set()
+    if current < seq:
+        return current, None # Database replaced
+    return current, CHANGES.entities_between(DB_FILE, seq, current, skip)
+
+def db_identity():
+    """(db_uid, change_seq) of DB_FILE: which database, and how many writes it has seen."""
+    conn = get_connection()
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('db_uid', 'change_seq')").fetchall())
+    finally:
+        conn.close()
+    return meta.get('db_uid', 0), meta.get('change_seq', 0)
+
+# --- Portfolio Snapshot ---
+# After every committed write, a background thread saves the loaded and rolled-up
+# portfolio next to the database (<db>.snapshot) so new processes can skip the
+# SQL load and rollup. The file is a fixed header followed by two pickles, the
+# project headers and then the module trees, so headers-only loads read just the
+# first part of the mapping. It is only used while its (db_uid, change_seq)
+# match the database; otherwise load_data falls back to SQL.
+SNAPSHOT_ENABLED = os.environ.get('AUTOPM_SNAPSHOT', '1').lower() not in ('', '0', 'false', 'no')
+SNAPSHOT_SCHEMA = 2 # Bump whenever the structure load_data returns changes
+_SNAPSHOT_MAGIC = b"APMS"
+_SNAPSHOT_HEADER = struct.Struct("<4sIqqQ") # magic, schema, db_uid, change_seq, length of the headers pickle
+
+_snapshot_lock = threading.Lock()
+_snapshot_state = {"thread": None, "dirty": False}
+
+def snapshot_path():
+    return DB_FILE + ".snapshot"
+
+def write_snapshot():
+    """
+    Writes the snapshot for the database's current state (atomically, via a
+    temp file and rename). Returns the change_seq it was taken at, or None.
+    """
+    path = snapshot_path()
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        for _ in range(3):
+            # No commit between the two reads means the load saw exactly that state
+            identity = db_identity()
+            projects = _load_from_db()
+            if db_identity() == identity:
+                break
+        else:
+            return None # Writes kept landing; the next commit schedules another attempt
+        trees = {p['id']: p.pop('modules') for p in projects}
+        headers = pickle.dumps(projects, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(tmp, 'wb') as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, SNAPSHOT_SCHEMA, *identity, len(headers)))
+            f.write(headers)
+            pickle.dump(trees, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return identity[1]
+    except Exception as e:
+        print(f"Snapshot failed: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+def read_snapshot(headers_only=False):
+    """Projects from the snapshot if it matches the database's current state, otherwise None."""
+    try:
+        with open(snapshot_path(), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, schema, db_uid, change_seq, headers_len = _SNAPSHOT_HEADER.unpack_from(mm)
+            if magic != _SNAPSHOT_MAGIC or schema != SNAPSHOT_SCHEMA or (db_uid, change_seq) != db_identity():
+                return None
+            start = _SNAPSHOT_HEADER.size
+            projects = pickle.loads(mm[start:start + headers_len])
+            if not headers_only:
+                trees = pickle.loads(mm[start + headers_len:])
+                for p in projects:
+                    p['modules'] = trees[p['id']]
+            return projects
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot: {e}")
+        return None
+
+def schedule_snapshot():
+    """Refreshes the snapshot on a background thread; requests made meanwhile coalesce into one more run."""
+    if not SNAPSHOT_ENABLED:
+        return
+    with _snapshot_lock:
+        _snapshot_state["dirty"] = True
+        if _snapshot_state["thread"] is None:
+            _snapshot_state["thread"] = threading.Thread(target=_snapshot_worker, name="autopm-snapshot", daemon=True)
+            _snapshot_state["thread"].start()
+
+def _snapshot_worker():
+    while True:
+        with _snapshot_lock:
+            if not _snapshot_state["dirty"]:
+                _snapshot_state["thread"] = None
+                return
+            _snapshot_state["dirty"] = False
+        write_snapshot()
+
+def _remember(entity, fields):
+    """Stores the values as loaded so save_data can tell what this session changed."""
+    entity['_orig'] = {f: entity.get(f) for f in fields}
+
+def _remember_gateway(gw_data):
+    gw_data['_orig'] = {f: gw_data.get(f, '') or '' for f in ('p', 'a', 'ecn')}
+
+class LazyProject(dict):
+    """
+    Project dict whose 'modules' are loaded from SQLite the first time they
+    are accessed (p['modules'], p.get('modules')). Everything else behaves
+    like the plain dicts returned by load_data.
+    """
+    def __init__(self, data, modules_rev=0, cache=None):
+        super().__init__(data)
+        self.modules_rev = modules_rev
+        self.cache = cache
+
+    @property
+    def modules_loaded(self):
+        return dict.__contains__(self, 'modules')
+
+    def __missing__(self, key):
+        if key != 'modules':
+            raise KeyError(key)
+        hydrate_modules([self], self.cache)
+        return dict.__getitem__(self, 'modules')
+
+    def get(self, key, default=None):
+        if key == 'modules' and not self.modules_loaded:
+            return self['modules']
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return key == 'modules' or dict.__contains__(self, key)
+
+class ModuleCache:
+    """
+    Bounded LRU of hydrated module trees, keyed by (project_id, modules_rev).
+    Meant to live in one user session; a new modules_rev (any committed change
+    below the project) simply misses and reloads.
+    """
+    def __init__(self, max_projects=50):
+        self.max_projects = max_projects
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        return None
+
+    def put(self, key, modules):
+        self._entries[key] = modules
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_projects:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+def loaded_modules(p):
+    """The project's modules if they are in memory, without triggering lazy loading."""
+    if isinstance(p, LazyProject) and not p.modules_loaded:
+        return None
+    return p.get('modules')
+
+def _project_filter(project_ids=None, types=None, name_like=None):
+    """Builds the WHERE clause (on table alias 'pr') shared by the filtered queries."""
+    clauses, params = [], []
+    if project_ids is not None:
+        # One JSON parameter however many ids (a '?' each would hit SQLite's variable limit)
+        clauses.append("pr.id IN (SELECT value FROM json_each(?))" if project_ids else "0")
+        params.append(json.dumps(list(project_ids)))
+    if types is not None:
+        clauses.append(f"pr.type IN ({', '.join('?' * len(types))})" if types else "0")
+        params.extend(types)
+    if name_like:
+        clauses.append("pr.name LIKE ? ESCAPE '\\'")
+        params.append(name_like)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def list_project_types():
+    """Distinct project types, for filter widgets that should not load any projects."""
     if not os.path.exists(DB_FILE):
         return []
+    conn = get_connection()
+    try:
+        return [r[0] for r in conn.execute("SELECT DISTINCT type FROM projects WHERE type IS NOT NULL ORDER BY type")]
+    finally:
+        conn.close()
+
+def page_project_ids(types=None, name_like=None, limit=None, offset=0):
+    """
+    (ids, total): one page of the project ids matching the load_data filters,
+    in load_data order, and the number of matching projects across all pages.
+    """
+    if not os.path.exists(DB_FILE):
+        return [], 0
+    where, params = _project_filter(None, types, name_like)
+    conn = get_connection()
+    try:
+        rows = conn.execute(f"SELECT pr.id, COUNT(*) OVER () FROM projects pr{where} ORDER BY pr.rowid LIMIT ? OFFSET ?",
+                            params + [-1 if limit is None else limit, offset]).fetchall()
+        if rows:
+            total = rows[0][1]
+        else: # Past the last page: the window count has no row to ride on
+            total = conn.execute(f"SELECT COUNT(*) FROM projects pr{where}", params).fetchone()[0]
+    finally:
+        conn.close()
+    return [r[0] for r in rows], total
+
+# Entity and project context for a 'hits' CTE of (kind, entity_id, body, ord)
+_SEARCH_CONTEXT = """
+    SELECT h.kind, h.entity_id AS id, h.body AS text, pr.id AS project_id, pr.name AS project,
+           COALESCE(m.name, gm.name) AS module, g.gateway
+    FROM hits h
+    LEFT JOIN modules m ON h.kind = 'module' AND m.id = h.entity_id
+    LEFT JOIN gateways g ON h.kind = 'ecn' AND g.id = h.entity_id
+    LEFT JOIN modules gm ON g.entity_type = 'module' AND gm.id = g.entity_id
+    JOIN projects pr ON pr.id = CASE h.kind WHEN 'project' THEN h.entity_id WHEN 'module' THEN m.project_id
+                                WHEN 'ecn' THEN IIF(g.entity_type = 'module', gm.project_id, g.entity_id) END
+    ORDER BY h.ord"""
+
+def like_pattern(text):
+    """LIKE pattern (with ESCAPE '\\') matching values that contain 'text' literally, e.g. for name_like."""
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _like_terms(column, terms):
+    """AND of case-insensitive substring matches, one per term."""
+    clause = " AND ".join(f"{column} LIKE ? ESCAPE '\\'" for _ in terms)
+    return clause, [like_pattern(t) for t in terms]
+
+@timed()
+def search(query, limit=50):
+    """
+    Projects, modules (any depth) and ECNs whose text contains every word of
+    'query' (case-insensitive), best matches first.
+    Returns [{'kind': 'project'|'module'|'ecn', 'id', 'text', 'project_id',
+    'project', 'module', 'gateway'}]; 'module' and 'gateway' are None where
+    they do not apply.
+
+    Uses the search_index FTS5 table (kept current by triggers, see
+    migrate_to_sqlite.create_search_index); words shorter than three
+    characters, or a SQLite without FTS5, fall back to LIKE.
+    """
+    terms = query.split()
+    if not terms or not os.path.exists(DB_FILE):
+        return []
+    conn = get_connection()
+    try:
+        has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name='search_index'").fetchone()
+        if has_index and all(len(t) >= 3 for t in terms):
+            # Each word as a quoted trigram phrase: a substring match, with bm25 ranking
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+            hits = "SELECT kind, entity_id, body, rank AS ord FROM search_index WHERE search_index MATCH ? ORDER BY rank LIMIT ?"
+            params = [match, limit]
+        elif has_index:
+            where, params = _like_terms("body", terms)
+            hits = f"SELECT kind, entity_id, body, rowid AS ord FROM search_index WHERE {where} LIMIT ?"
+            params.append(limit)
+        else:
+            parts, params = [], []
+            for order, (kind, table, column, extra) in enumerate((('project', 'projects', 'name', ''),
+                                                                  ('module', 'modules', 'name', ''),
+                                                                  ('ecn', 'gateways', 'ecn', "ecn <> '' AND "))):
+                where, term_params = _like_terms(column, terms)
+                parts.append(f"SELECT '{kind}', id, {column}, {order} FROM {table} WHERE {extra}{where}")
+                params.extend(term_params)
+            hits = " UNION ALL ".join(parts) + " LIMIT ?"
+            params.append(limit)
+        rows = conn.execute(f"WITH hits (kind, entity_id, body, ord) AS ({hits}) {_SEARCH_CONTEXT}", params).fetchall()
+        perf_count('rows', len(rows))
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+@timed()
+@mem_profiled()
+def load_data(project_ids=None, types=None, name_like=None, headers_only=False, lazy=False, cache=None):
+    """
+    Loads projects from the SQLite database and reconstructs the nested dictionary.
+
+    Filters are applied in SQL:
+    - project_ids: only these project IDs
+    - types: only projects whose type is in this list
+    - name_like: SQL LIKE pattern on the project name, e.g. '%Door%' (backslash escapes; see like_pattern)
+    - headers_only: project rows and project gateways only, no 'modules' key.
+      Project actuals are the DB-maintained rollups.
+    - lazy: return LazyProject objects whose modules load on first access,
+      reusing trees from 'cache' (a ModuleCache) when still current.
+
+    Full and headers-only loads (optionally by type) are served from the
+    portfolio snapshot when it is current.
+    """
+    if not os.path.exists(DB_FILE):
+        return []
+
+    try:
+        stale_snapshot = False
+        if SNAPSHOT_ENABLED and project_ids is None and name_like is None and not lazy:
+            projects = read_snapshot(headers_only)
+            if projects is not None:
+                perf_count('snapshot_hits')
+                if types is not None:
+                    projects = [p for p in projects if p['type'] in types]
+                return projects
+            stale_snapshot = True # Missing or stale (e.g. written to while no app was running)
+        projects = _load_from_db(project_ids, types, name_like, headers_only, lazy, cache)
+        if stale_snapshot:
+            schedule_snapshot() # Only now: this load's connection has brought the schema up to date
+        return projects
+    except Exception as e:
+        print(f"Error loading data from DB: {e}")
+        return []
 
+def _load_from_db(project_ids=None, types=None, name_like=None, headers_only=False, lazy=False, cache=None):
+    """The SQL path of load_data; raises on errors."""
     projects = []
+    conn = get_connection()
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row # Access columns by name
         cursor = conn.cursor()
+        where, params = _project_filter(project_ids, types, name_like)
+        selected = f"SELECT pr.id FROM projects pr{where}"
         
         # 1. Fetch Projects
-        cursor.execute("SELECT * FROM projects")
-        projs_db = cursor.fetchall()
-        
-        for p_row in projs_db:
+        by_id = {}
+        proj_rows = cursor.execute(f"SELECT * FROM projects pr{where} ORDER BY pr.rowid", params).fetchall()
+        perf_count('rows', len(proj_rows))
+        for p_row in proj_rows:
             p = {
                 "id": p_row["id"],
                 "name": p_row["name"],
                 "type": p_row["type"],
-                "gateways": {},
-                "modules": []
+                "version": p_row["version"],
+                "gateways": {}
             }
-            
-            # Fetch Project Gateways
-            cursor.execute("SELECT * FROM gateways WHERE entity_type='project' AND entity_id=?", (p["id"],))
-            p_gws = cursor.fetchall()
-            for gw in p_gws:
-                 p["gateways"][gw["gateway"]] = {
-                    "p": gw["plan_date"],
-                    "a": gw["actual_date"] if gw["actual_date"] else ""
-                }
-            
-            # 2. Fetch Modules (Top Level)
-            cursor.execute("SELECT * FROM modules WHERE project_id=? AND parent_module_id IS NULL", (p["id"],))
-            mods_db = cursor.fetchall()
-            
-            for m_row in mods_db:
-                m = {
-                    "id": m_row["id"],
-                    "name": m_row["name"],
-                    "gateways": {},
-                    "sub_modules": []
-                }
-                
-                # Fetch Module Gateways
-                cursor.execute("SELECT * FROM gateways WHERE entity_type='module' AND entity_id=?", (m["id"],))
-                m_gws = cursor.fetchall()
-                for gw in m_gws:
-                    m["gateways"][gw["gateway"]] = {
-                        "p": gw["plan_date"],
-                        "a": gw["actual_date"],
-                        "ecn": gw["ecn"]
-                    }
-                
-                # 3. Fetch Sub-Modules
-                cursor.execute("SELECT * FROM modules WHERE project_id=? AND parent_module_id=?", (p["id"], m["id"]))
-                subs_db = cursor.fetchall()
-                for s_row in subs_db:
-                    s = {
-                        "id": s_row["id"],
-                        "name": s_row["name"],
-                        "gateways": {}
-                    }
-                    # Fetch Sub-Module Gateways
-                    cursor.execute("SELECT * FROM gateways WHERE entity_type='module' AND entity_id=?", (s["id"],))
-                    s_gws = cursor.fetchall()
-                    for gw in s_gws:
-                        s["gateways"][gw["gateway"]] = {
-                            "p": gw["plan_date"],
-                            "a": gw["actual_date"],
-                            "ecn": gw["ecn"]
-                        }
-                    m["sub_modules"].append(s)
-                
-                p["modules"].append(m)
-            
+            if lazy:
+                p = LazyProject(p, p_row["modules_rev"], cache)
+            elif not headers_only:
+                p["modules"] = []
+            _remember(p, ('name', 'type'))
+            by_id[p["id"]] = p
             projects.append(p)
             
+        # Fetch Project Gateways (one query for all selected projects)
+        gw_rows = cursor.execute(f"SELECT * FROM gateways WHERE entity_type='project' AND entity_id IN ({selected}) ORDER BY id", params).fetchall()
+        perf_count('rows', len(gw_rows))
+        for gw in gw_rows:
+            gw_data = by_id[gw["entity_id"]]["gateways"][gw["gateway"]] = {
+                "p": gw["plan_date"],
+                "a": gw["actual_date"] if gw["actual_date"] else "",
+                "version": gw["version"]
+            }
+            _remember_gateway(gw_data)
+
+        if headers_only or lazy:
+            return projects
+            
+        # 2. Fetch Modules and Sub-Modules
+        for p_id, mods in _fetch_module_trees(cursor, selected, params).items():
+            by_id[p_id]["modules"] = mods
+    finally:
         conn.close()
         
-        # Ensure Rollups are calculated on Load to guarantee consistency
-        calculate_rollup(projects)
-        
-        return projects
-    except Exception as e:
-        print(f"Error loading data from DB: {e}")
-        return []
+    # Ensure Rollups are calculated on Load to guarantee consistency
+    calculate_rollup(projects)
+    
+    return projects
 
-def save_data(projects):
-    """Saves projects to the SQLite database (Full Sync)."""
+def walk_modules(modules):
+    """
+    Yields (module, parent, depth) for every module in the trees under 'modules',
+    parents before children, siblings in order. Top-level modules have parent None
+    and depth 0. Iterative, so any depth works.
+    """
+    stack = [(m, None, 0) for m in reversed(modules)]
+    while stack:
+        m, parent, depth = stack.pop()
+        yield m, parent, depth
+        stack.extend((s, m, depth + 1) for s in reversed(m.get('sub_modules', [])))
+
+def _post_order(modules):
+    """Every module in the trees under 'modules', children before their parent."""
+    order = [m for m, _, _ in walk_modules(modules)]
+    order.reverse()
+    return order
+
+def _fetch_module_trees(cursor, selected, params):
+    """
+    Loads the module trees (any depth) and their gateways for the projects
+    matched by the 'selected' subquery, in one recursive query.
+    Returns {project_id: [top-level modules]}; every module has a
+    'sub_modules' list. Rows not reachable from a top-level module are skipped.
+    """
+    rows = cursor.execute(f"""
+        WITH RECURSIVE tree(id, project_id, parent_module_id, name, version) AS (
+            SELECT id, project_id, NULL, name, version FROM modules
+            WHERE parent_module_id IS NULL AND project_id IN ({selected})
+            UNION ALL
+            SELECT m.id, tree.project_id, m.parent_module_id, m.name, m.version
+            FROM modules m JOIN tree ON m.parent_module_id = tree.id
+        )
+        SELECT tree.*, g.gateway, g.plan_date, g.actual_date, g.ecn, g.version AS gw_version
+        FROM tree LEFT JOIN gateways g ON g.entity_type = 'module' AND g.entity_id = tree.id
+        ORDER BY tree.id, g.id""", params).fetchall()
+    perf_count('rows', len(rows))
+
+    modules = {} # id -> module, in id (= creation) order
+    placement = [] # (module, parent_id, project_id)
+    for r in rows:
+        m = modules.get(r["id"])
+        if m is None:
+            m = modules[r["id"]] = {
+                "id": r["id"],
+                "name": r["name"],
+                "version": r["version"],
+                "gateways": {},
+                "sub_modules": []
+            }
+            _remember(m, ('name',))
+            placement.append((m, r["parent_module_id"], r["project_id"]))
+        if r["gateway"] is not None:
+            gw_data = m["gateways"][r["gateway"]] = {
+                "p": r["plan_date"],
+                "a": r["actual_date"],
+                "ecn": r["ecn"],
+                "version": r["gw_version"]
+            }
+            _remember_gateway(gw_data)
+
+    trees = {}
+    for m, parent_id, project_id in placement:
+        if parent_id is None:
+            trees.setdefault(project_id, []).append(m)
+        else:
+            modules[parent_id]["sub_modules"].append(m)
+    return trees
+
+@timed()
+@mem_profiled()
+def hydrate_modules(projects, cache=None):
+    """
+    Loads 'modules' for every LazyProject in 'projects' that does not have them
+    yet: from 'cache' when current, otherwise in one batch for all of them.
+    """
+    pending = [p for p in projects if isinstance(p, LazyProject) and not p.modules_loaded]
+    missing = []
+    for p in pending:
+        cached = cache.get((p['id'], p.modules_rev)) if cache is not None else None
+        if cached is not None:
+            dict.__setitem__(p, 'modules', cached)
+        else:
+            missing.append(p)
+    if not missing:
+        return
+
+    ids = [p['id'] for p in missing]
+    conn = get_connection()
     try:
-        # Pre-calculation Rollup
-        calculate_rollup(projects)
+        trees = _fetch_module_trees(conn.cursor(), "SELECT id FROM projects WHERE id IN (SELECT value FROM json_each(?))",
+                                    (json.dumps(ids),))
+    finally:
+        conn.close()
+    for p in missing:
+        dict.__setitem__(p, 'modules', trees.get(p['id'], []))
+        if cache is not None:
+            cache.put((p['id'], p.modules_rev), p['modules'])
+    calculate_rollup(missing)
 
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Transaction: Delete All -> Insert All
-        # This ensures we match the in-memory state exactly
-        cursor.execute("DELETE FROM gateways")
-        cursor.execute("DELETE FROM modules")
-        cursor.execute("DELETE FROM projects")
-        
-        for p in projects:
-            cursor.execute("INSERT INTO projects (id, name, type) VALUES (?, ?, ?)", 
-                           (p['id'], p['name'], p.get('type', '')))
-            
-            # Project Gateways
-            for gw, data in p.get('gateways', {}).items():
-                if isinstance(data, dict):
-                     cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date) VALUES (?, ?, ?, ?, ?)",
-                                   ('project', p['id'], gw, data.get('p', ''), data.get('a', '')))
-                else: 
-                     # Fallback for old structure if any runtime obj somehow missed rollup
-                     cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date) VALUES (?, ?, ?, ?)",
-                                   ('project', p['id'], gw, data))
-            
-            if 'modules' in p:
-                for m in p['modules']:
-                    cursor.execute("INSERT INTO modules (id, project_id, name) VALUES (?, ?, ?)",
-                                   (m['id'], p['id'], m['name']))
-                    
-                    # Module Gateways
-                    for gw, data in m.get('gateways', {}).items():
-                        if isinstance(data, dict):
-                            cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) VALUES (?, ?, ?, ?, ?, ?)",
-                                           ('module', m['id'], gw, data.get('p', ''), data.get('a', ''), data.get('ecn', '')))
-                    
-                    if 'sub_modules' in m:
-                        for s in m['sub_modules']:
-                            cursor.execute("INSERT INTO modules (id, project_id, name, parent_module_id) VALUES (?, ?, ?, ?)",
-                                           (s['id'], p['id'], s['name'], m['id']))
-                            
-                            for gw, data in s.get('gateways', {}).items():
-                                if isinstance(data, dict):
-                                    cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) VALUES (?, ?, ?, ?, ?, ?)",
-                                                   ('module', s['id'], gw, data.get('p', ''), data.get('a', ''), data.get('ecn', '')))
-        
+@timed()
+def module_adherence(project_ids=None, types=None):
+    """
+    Per-project module adherence, computed in SQL without loading modules.
+    Compares each top-level module's actual against the project plan for
+    the same gateway (same rules as get_status).
+    Returns {project_id: {'green', 'yellow', 'red', 'on_time', 'completed'}}.
+    """
+    if not os.path.exists(DB_FILE):
+        return {}
+    where, params = _project_filter(project_ids, types)
+    conn = get_connection()
+    try:
+        return _module_adherence(conn.cursor(), where, params)
+    finally:
+        conn.close()
+
+def _module_adherence(cursor, where, params):
+    """The query behind module_adherence, for a _project_filter clause."""
+    gw_marks = ", ".join("?" * len(GATEWAYS))
+    rows = cursor.execute(f"""
+        SELECT project_id,
+            SUM(CASE WHEN diff <= 0 THEN 1 ELSE 0 END) AS green,
+            SUM(CASE WHEN diff > 0 AND diff <= 30 THEN 1 ELSE 0 END) AS yellow,
+            SUM(CASE WHEN diff > 30 THEN 1 ELSE 0 END) AS red,
+            SUM(CASE WHEN plan <> '' AND actual <= plan THEN 1 ELSE 0 END) AS on_time,
+            SUM(CASE WHEN plan <> '' THEN 1 ELSE 0 END) AS completed
+        FROM (
+            SELECT m.project_id, IFNULL(pg.plan_date, '') AS plan, mg.actual_date AS actual,
+                   julianday(mg.actual_date) - julianday(pg.plan_date) AS diff
+            FROM modules m
+            -- CROSS JOIN keeps modules as the outer loop: a few projects' modules
+            -- via idx_modules_project, not every module gateway in the table
+            CROSS JOIN gateways mg ON mg.entity_type='module' AND mg.entity_id=m.id
+            LEFT JOIN gateways pg ON pg.entity_type='project' AND pg.entity_id=m.project_id AND pg.gateway=mg.gateway
+            WHERE m.parent_module_id IS NULL AND mg.gateway IN ({gw_marks})
+              AND mg.actual_date IS NOT NULL AND mg.actual_date <> ''
+              AND m.project_id IN (SELECT pr.id FROM projects pr{where})
+        )
+        GROUP BY project_id""", (*GATEWAYS, *params)).fetchall()
+    perf_count('rows', len(rows))
+    return {r['project_id']: dict(r) for r in rows}
+
+# --- Materialized Dashboard KPIs ---
+# portfolio_stats holds one row per project: its health status (as the KPI
+# cards count it) and its module adherence counts. save_data and
+# delete_module refresh the rows of the projects they touched inside their
+# transaction, so the Dashboard reads committed, current KPIs with one query
+# instead of recomputing them for every viewer.
+
+_STATS_CHUNK = 500 # Projects per refresh batch (keeps IN lists under SQLite's variable limit)
+
+def refresh_portfolio_stats(cursor, project_ids=None):
+    """
+    Recomputes the portfolio_stats rows of 'project_ids' (all projects when
+    None) from the rows in the DB, on the caller's cursor/transaction.
+    """
+    if project_ids is None:
+        cursor.execute("DELETE FROM portfolio_stats")
+        _write_portfolio_stats(cursor, "", [])
+        record_daily_snapshot(cursor)
+        return
+    ids = list(project_ids)
+    types = set() # Before and after: a project can change type or be deleted
+    for start in range(0, len(ids), _STATS_CHUNK):
+        chunk = ids[start:start + _STATS_CHUNK]
+        in_chunk = f"project_id IN ({', '.join('?' * len(chunk))})"
+        types.update(r[0] for r in cursor.execute(f"SELECT DISTINCT IFNULL(type, '') FROM portfolio_stats WHERE {in_chunk}", chunk))
+        cursor.execute(f"DELETE FROM portfolio_stats WHERE {in_chunk}", chunk)
+        types.update(_write_portfolio_stats(cursor, *_project_filter(chunk)))
+    record_daily_snapshot(cursor, types)
+
+def _write_portfolio_stats(cursor, where, params):
+    """Inserts the portfolio_stats rows of the projects matching 'where'; returns their types ('' for none)."""
+    projects = {r['id']: {"id": r['id'], "name": r['name'], "type": r['type'], "gateways": {}}
+                for r in cursor.execute(f"SELECT id, name, type FROM projects pr{where}", params)}
+    for r in cursor.execute(f"""
+            SELECT entity_id, gateway, plan_date, actual_date FROM gateways
+            WHERE entity_type='project' AND entity_id IN (SELECT pr.id FROM projects pr{where})""", params):
+        projects[r['entity_id']]['gateways'][r['gateway']] = {"p": r['plan_date'], "a": r['actual_date'] or ""}
+    adherence = _module_adherence(cursor, where, params)
+    rows = []
+    for p_id, p in projects.items():
+        a = adherence.get(p_id, {})
+        rows.append((p_id, p['name'], p['type'], project_health(p),
+                     a.get('green', 0), a.get('yellow', 0), a.get('red', 0), a.get('on_time', 0), a.get('completed', 0),
+                     project_slip(p)))
+    cursor.executemany("""
+        INSERT INTO portfolio_stats (project_id, name, type, status, mod_green, mod_yellow, mod_red, on_time, completed, slip)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    return {p['type'] or '' for p in projects.values()}
+
+def _ensure_portfolio_stats(conn):
+    """
+    Fills portfolio_stats when it does not cover every project, e.g. right
+    after the table was added or for a database seeded by another tool.
+    """
+    missing, no_history = conn.execute("""
+        SELECT (SELECT COUNT(*) FROM projects) <> (SELECT COUNT(*) FROM portfolio_stats),
+               NOT EXISTS (SELECT 1 FROM portfolio_daily)""").fetchone()
+    if missing:
+        refresh_portfolio_stats(conn.cursor())
+        conn.commit()
+    elif no_history:
+        record_daily_snapshot(conn.cursor())
         conn.commit()
+
+@timed()
+def portfolio_stats(types=None):
+    """
+    Dashboard KPIs read from portfolio_stats with one query (filtered by
+    project type when 'types' is given). Returns a dict with:
+    - projects: [{'id', 'name'}] in project order
+    - stats: overall counts, as calculate_dashboard_stats returns them
+    - by_type: {type: counts in the same shape}
+    - adherence: {project_id: counts}, as module_adherence returns them
+    """
+    empty = {"total": 0, "active": 0, "green": 0, "yellow": 0, "red": 0}
+    result = {"projects": [], "stats": dict(empty), "by_type": {}, "adherence": {}}
+    if not os.path.exists(DB_FILE):
+        return result
+    where, params = "", []
+    if types is not None:
+        where = f" WHERE type IN ({', '.join('?' * len(types))})" if types else " WHERE 0"
+        params = list(types)
+    conn = get_connection()
+    try:
+        rows = conn.execute(f"SELECT * FROM portfolio_stats{where} ORDER BY project_id", params).fetchall()
+    finally:
         conn.close()
-        return True
-    except Exception as e:
-        print(f"Error saving data to DB: {e}")
+    perf_count('rows', len(rows))
+    for r in rows:
+        result["projects"].append({"id": r['project_id'], "name": r['name']})
+        for counts in (result["stats"], result["by_type"].setdefault(r['type'], dict(empty))):
+            counts["total"] += 1
+            counts["active"] += 1
+            counts[r['status']] += 1
+        result["adherence"][r['project_id']] = {
+            "green": r['mod_green'], "yellow": r['mod_yellow'], "red": r['mod_red'],
+            "on_time": r['on_time'], "completed": r['completed'],
+        }
+    return result
+
+# --- History ---
+# Trends are read from portfolio_daily (one row per day and project type,
+# written below whenever portfolio_stats changes) and per-gateway changes from
+# gateway_history (kept by triggers, see migrate_to_sqlite.create_history).
+# Both are plain indexed range queries; backups are never opened.
+
+_DAILY_COUNTS = ["projects", "green", "yellow", "red", "mod_green", "mod_yellow", "mod_red", "on_time", "completed", "slip"]
+
+def record_daily_snapshot(cursor, types=None):
+    """
+    Writes today's portfolio_daily rows from the current portfolio_stats
+    totals, on the caller's transaction. With 'types' only the rows of those
+    project types are recomputed and upserted (a type left without projects
+    gets zeros); the day's first snapshot always covers every type.
+    """
+    if types is not None:
+        if not types:
+            return
+        # The OR lets both halves use idx_portfolio_stats_type ('' also stands for NULL types)
+        cursor.execute(f"""
+            INSERT INTO portfolio_daily (day, type, projects, green, yellow, red,
+                                         mod_green, mod_yellow, mod_red, on_time, completed, slip)
+            SELECT date('now', 'localtime'), t.value, COUNT(s.project_id), IFNULL(SUM(s.status = 'green'), 0),
+                   IFNULL(SUM(s.status = 'yellow'), 0), IFNULL(SUM(s.status = 'red'), 0), IFNULL(SUM(s.mod_green), 0),
+                   IFNULL(SUM(s.mod_yellow), 0), IFNULL(SUM(s.mod_red), 0), IFNULL(SUM(s.on_time), 0),
+                   IFNULL(SUM(s.completed), 0), IFNULL(SUM(s.slip), 0)
+            FROM json_each(?) t LEFT JOIN portfolio_stats s ON s.type = t.value OR (t.value = '' AND s.type IS NULL)
+            WHERE EXISTS (SELECT 1 FROM portfolio_daily WHERE day = date('now', 'localtime'))
+            GROUP BY t.value
+            ON CONFLICT(day, type) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in _DAILY_COUNTS)}""",
+            (json.dumps(sorted(types)),))
+        if cursor.rowcount > 0:
+            return
+        # Nothing written: no snapshot yet today, so take the first one in full
+    cursor.execute("DELETE FROM portfolio_daily WHERE day = date('now', 'localtime')")
+    cursor.execute("""
+        INSERT INTO portfolio_daily (day, type, projects, green, yellow, red,
+                                     mod_green, mod_yellow, mod_red, on_time, completed, slip)
+        SELECT date('now', 'localtime'), IFNULL(type, ''), COUNT(*), SUM(status = 'green'), SUM(status = 'yellow'),
+               SUM(status = 'red'), SUM(mod_green), SUM(mod_yellow), SUM(mod_red), SUM(on_time), SUM(completed), SUM(slip)
+        FROM portfolio_stats GROUP BY IFNULL(type, '')""")
+
+@timed()
+def portfolio_trend(start, end=None, types=None):
+    """
+    Daily portfolio totals from 'start' to 'end' (dates, inclusive; end
+    defaults to today), optionally for some project types only.
+    Returns one dict per day: 'day' (YYYY-MM-DD) plus the portfolio_daily
+    counts summed over the types ('slip' is the total days late of the
+    projects' latest released gateways). Days without a snapshot repeat the
+    one before (nothing changed); days before the first snapshot are omitted.
+    """
+    if not os.path.exists(DB_FILE):
+        return []
+    end = end or date.today()
+    # Filtered inside the sums, so every snapshot day is returned (a type can have no row that day)
+    selected, params = "1", []
+    if types is not None:
+        selected = f"type IN ({', '.join('?' * len(types))})" if types else "0"
+        params = [t or '' for t in types]
+    sums = ", ".join(f"SUM(IIF({selected}, {c}, 0)) AS {c}" for c in _DAILY_COUNTS)
+    conn = get_connection()
+    try:
+        # From the last snapshot on or before 'start' (the state that day), via the (day, type) key
+        rows = conn.execute(f"""
+            SELECT day, {sums} FROM portfolio_daily
+            WHERE day >= IFNULL((SELECT MAX(day) FROM portfolio_daily WHERE day <= ?), ?) AND day <= ?
+            GROUP BY day ORDER BY day""",
+            (*params * len(_DAILY_COUNTS), start.isoformat(), start.isoformat(), end.isoformat())).fetchall()
+    finally:
+        conn.close()
+    perf_count('rows', len(rows))
+    snapshots = {r['day']: {c: r[c] for c in _DAILY_COUNTS} for r in rows}
+    if not snapshots:
+        return []
+    first = min(snapshots)
+    trend, current = [], snapshots[first]
+    day = max(start, date.fromisoformat(first))
+    while day <= end:
+        current = snapshots.get(day.isoformat(), current)
+        trend.append(dict(current, day=day.isoformat()))
+        day += timedelta(days=1)
+    return trend
+
+@timed()
+def gateway_history(entity_type, entity_id, start=None, end=None):
+    """
+    Changes to one project's or module's gateways, oldest first, optionally
+    between 'start' and 'end' (dates, inclusive). Each dict has changed_at,
+    op ('I', 'U', 'D'), gateway and the plan_date, actual_date and status
+    after the change (unchanged values are filled in from earlier rows).
+    """
+    if not os.path.exists(DB_FILE):
+        return []
+    conn = get_connection()
+    try:
+        # Earlier rows are read too: a delta row needs them to be filled in
+        rows = conn.execute("""
+            SELECT changed_at, op, gateway, plan_date, actual_date, status FROM gateway_history
+            WHERE entity_type = ? AND entity_id = ? AND changed_at < ?
+            ORDER BY changed_at, id""",
+            (entity_type, entity_id, (end + timedelta(days=1)).isoformat() if end else "9999")).fetchall()
+    finally:
+        conn.close()
+    perf_count('rows', len(rows))
+    state, changes = {}, []
+    for r in rows:
+        if r['op'] == 'D':
+            state.pop(r['gateway'], None)
+            values = {"plan_date": None, "actual_date": None, "status": None}
+        else:
+            values = state.setdefault(r['gateway'], {})
+            for k in ("plan_date", "actual_date", "status"):
+                if r[k] is not None:
+                    values[k] = r[k]
+        if start is None or r['changed_at'] >= start.isoformat():
+            changes.append({"changed_at": r['changed_at'], "op": r['op'], "gateway": r['gateway'], **values})
+    return changes
+
+# --- Upcoming / Overdue Gateways ---
+
+OPEN_GATEWAY_SORTS = {
+    "plan_date": "g.plan_date, p.name, g.gateway",
+    "project": "p.name, g.plan_date, g.gateway",
+    "gateway": "g.gateway, g.plan_date, p.name",
+}
+
+@timed()
+def open_gateways(status='upcoming', days=30, entity_type='module', types=None, project_ids=None,
+                  sort='plan_date', descending=False, limit=50, offset=0, today=None):
+    """
+    Gateways with a plan date but no actual, filtered, sorted and paged in SQL
+    (backed by the partial index idx_gateways_open_plan).
+
+    - status 'upcoming': planned within the next 'days' days (today included);
+      'overdue': planned before today, at most 'days' days ago (None = any).
+    - entity_type: 'module' (any depth) or 'project'
+    - types / project_ids: project filters, as in load_data
+    - sort: a key of OPEN_GATEWAY_SORTS
+    Returns (rows, total): one page of dicts with 'entity_type', 'entity_id',
+    'gateway', 'plan_date', 'days' (until the plan date; negative when
+    overdue), 'project_id', 'project', 'type' and 'module' (None for
+    projects), plus the number of matching gateways across all pages.
+    """
+    if not os.path.exists(DB_FILE):
+        return [], 0
+    today = today or date.today()
+    if status == 'upcoming':
+        start, end = today, today + timedelta(days=days)
+    elif status == 'overdue':
+        start = today - timedelta(days=days) if days is not None else None
+        end = today - timedelta(days=1)
+    else:
+        raise ValueError(f"Unknown status: {status}")
+
+    clauses = ["g.entity_type = ?", "IFNULL(g.actual_date, '') = ''", "g.plan_date <= ?"]
+    params = [entity_type, end.isoformat()]
+    clauses.append("g.plan_date >= ?")
+    params.append(start.isoformat() if start else "0") # Every date sorts after '0'; '' does not
+    where, filter_params = _project_filter(project_ids, types)
+    if where:
+        clauses.append(f"p.id IN (SELECT pr.id FROM projects pr{where})")
+        params.extend(filter_params)
+
+    order = OPEN_GATEWAY_SORTS[sort]
+    if descending:
+        order = ", ".join(f"{col} DESC" for col in order.split(", "))
+    conn = get_connection()
+    try:
+        rows = conn.execute(f"""
+            SELECT g.entity_type, g.entity_id, g.gateway, g.plan_date,
+                   CAST(julianday(g.plan_date) - julianday(?) AS INTEGER) AS days,
+                   p.id AS project_id, p.name AS project, p.type, m.name AS module,
+                   COUNT(*) OVER () AS total
+            FROM gateways g
+            LEFT JOIN modules m ON g.entity_type = 'module' AND m.id = g.entity_id
+            JOIN projects p ON p.id = IIF(g.entity_type = 'module', m.project_id, g.entity_id)
+            WHERE {" AND ".join(clauses)}
+            ORDER BY {order}
+            LIMIT ? OFFSET ?""", (today.isoformat(), *params, limit, offset)).fetchall()
+    finally:
+        conn.close()
+    perf_count('rows', len(rows))
+    total = rows[0]['total'] if rows else 0
+    if not rows and offset:
+        # Past the last page: the count has to come from its own query
+        return [], open_gateways(status, days, entity_type, types, project_ids, limit=1, today=today)[1]
+    return [{k: r[k] for k in r.keys() if k != 'total'} for r in rows], total
+
+@timed()
+@mem_profiled()
+def save_data(projects):
+    """
+    Saves in-memory edits to the SQLite database.
+
+    Only rows that differ from what was loaded are written, each as a
+    conditional UPDATE on its row version. If another session changed one of
+    those rows in the meantime nothing is written and ConcurrentEditError is
+    raised. Rows missing from 'projects' are left alone (see delete_module).
+    Derived actuals (module/project rollups) are recomputed inside the same
+    transaction from what is in the DB, so parallel edits to different
+    modules of one project both end up in the project rollup. The same goes
+    for the touched projects' portfolio_stats rows.
+    """
+    # Pre-calculation Rollup (keeps the in-memory view consistent)
+    calculate_rollup(projects)
+
+    conflicts = []
+    stamps = [] # (entity, new_version) applied once the commit succeeded
+    try:
+        with write_transaction() as cursor:
+            modules_changed = set()
+            touched = [] # Projects with at least one written row
+            for p in projects:
+                written = len(stamps)
+                if _save_project(cursor, p, conflicts, stamps):
+                    modules_changed.add(p['id'])
+                if len(stamps) > written:
+                    touched.append(p['id'])
+            if conflicts:
+                raise ConcurrentEditError(conflicts)
+            for p_id in touched:
+                if _rollup_project_in_db(cursor, p_id):
+                    modules_changed.add(p_id)
+            for p_id in modules_changed:
+                cursor.execute("UPDATE projects SET modules_rev = modules_rev + 1 WHERE id=?", (p_id,))
+            if touched:
+                refresh_portfolio_stats(cursor, touched)
+                mark_changed(cursor, touched)
+    except ConcurrentEditError:
+        raise
     except Exception as e:
         print(f"Error saving data to DB: {e}")
         return False
 
+    perf_count('rows_written', len(stamps))
+    for entity, version in stamps:
+        entity['version'] = version
+        if 'gateways' in entity:
+            _remember(entity, [f for f in entity.get('_orig', {})])
+        else:
+            _remember_gateway(entity)
+    return True
+
+def _save_project(cursor, p, conflicts, stamps):
+    label = p['name']
+    if 'version' not in p:
+        if cursor.execute("SELECT 1 FROM projects WHERE id=?", (p['id'],)).fetchone():
+            conflicts.append({"entity_type": "project", "entity_id": p['id'], "name": label,
+                              "reason": "created by another session"})
+            return False
+        cursor.execute("INSERT INTO projects (id, name, type) VALUES (?, ?, ?)",
+                       (p['id'], p['name'], p.get('type', '')))
+        stamps.append((p, 1))
+        _remember(p, ('name', 'type'))
+    else:
+        _update_row(cursor, "projects", p, {'name': p['name'], 'type': p.get('type', '')},
+                    {"entity_type": "project", "entity_id": p['id'], "name": label}, conflicts, stamps)
+
+    # Project actuals are always rolled up from modules
+    for gw, data in p.get('gateways', {}).items():
+        if not isinstance(data, dict):
+            # Fallback for old structure if any runtime obj somehow missed rollup
+            data = p['gateways'][gw] = {'p': data, 'a': ''}
+        _save_gateway(cursor, 'project', p['id'], gw, data, derived=True, label=label,
+                      conflicts=conflicts, stamps=stamps)
+
+    written = len(stamps)
+    # Parents first, so new children are inserted after the row they point to
+    for m, parent, _ in walk_modules(loaded_modules(p) or []):
+        _save_module(cursor, p, m, parent['id'] if parent else None, conflicts, stamps)
+    return len(stamps) > written
+
+def _save_module(cursor, p, m, parent_id, conflicts, stamps):
+    label = f"{p['name']} / {m['name']}"
+    if 'version' not in m:
+        if cursor.execute("SELECT 1 FROM modules WHERE id=?", (m['id'],)).fetchone():
+            conflicts.append({"entity_type": "module", "entity_id": m['id'], "name": label,
+                              "reason": "created by another session"})
+            return
+        cursor.execute("INSERT INTO modules (id, project_id, name, parent_module_id) VALUES (?, ?, ?, ?)",
+                       (m['id'], p['id'], m['name'], parent_id))
+        stamps.append((m, 1))
+        _remember(m, ('name',))
+    else:
+        _update_row(cursor, "modules", m, {'name': m['name']},
+                    {"entity_type": "module", "entity_id": m['id'], "name": label}, conflicts, stamps)
+
+    derived = bool(m.get('sub_modules'))
+    for gw, data in m.get('gateways', {}).items():
+        if isinstance(data, dict):
+            _save_gateway(cursor, 'module', m['id'], gw, data, derived=derived, label=label,
+                          conflicts=conflicts, stamps=stamps)
+
+def _update_row(cursor, table, entity, values, ident, conflicts, stamps):
+    """Conditional UPDATE of the columns that changed since load."""
+    orig = entity.get('_orig', {})
+    changed = {k: v for k, v in values.items() if orig.get(k) != v}
+    if not changed:
+        return
+    sets = ", ".join(f"{k}=?" for k in changed)
+    cursor.execute(f"UPDATE {table} SET {sets}, version=version+1 WHERE id=? AND version=?",
+                   (*changed.values(), entity['id'], entity['version']))
+    if cursor.rowcount == 0:
+        conflicts.append(dict(ident, fields=sorted(changed), reason="changed by another session"))
+    else:
+        stamps.append((entity, entity['version'] + 1))
+
+def _save_gateway(cursor, entity_type, entity_id, gw, data, derived, label, conflicts, stamps):
+    # Derived actuals are owned by _rollup_project_in_db, never by the client
+    values = {'plan_date': data.get('p', '') or '', 'actual_date': data.get('a', '') or '',
+              'ecn': data.get('ecn', '') or ''}
+    if entity_type == 'project':
+        del values['ecn']
+    if derived:
+        del values['actual_date']
+
+    ident = {"entity_type": entity_type, "entity_id": entity_id, "gateway": gw, "name": label}
+    if 'version' not in data:
+        row = cursor.execute("SELECT * FROM gateways WHERE entity_type=? AND entity_id=? AND gateway=?",
+                             (entity_type, entity_id, gw)).fetchone()
+        if row:
+            if any((row[k] or '') != v for k, v in values.items()):
+                conflicts.append(dict(ident, reason="created by another session"))
+            return
+        if derived:
+            values['actual_date'] = '' # Filled in by the rollup
+        cols = ", ".join(values)
+        cursor.execute(f"INSERT INTO gateways (entity_type, entity_id, gateway, {cols}) VALUES (?, ?, ?{', ?' * len(values)})",
+                       (entity_type, entity_id, gw, *values.values()))
+        stamps.append((data, 1))
+        return
+
+    orig = data.get('_orig', {})
+    orig_values = {'plan_date': orig.get('p', ''), 'actual_date': orig.get('a', ''), 'ecn': orig.get('ecn', '')}
+    changed = {k: v for k, v in values.items() if orig_values[k] != v}
+    if not changed:
+        return
+    sets = ", ".join(f"{k}=?" for k in changed)
+    cursor.execute(f"UPDATE gateways SET {sets}, version=version+1 "
+                   "WHERE entity_type=? AND entity_id=? AND gateway=? AND version=?",
+                   (*changed.values(), entity_type, entity_id, gw, data['version']))
+    if cursor.rowcount == 0:
+        conflicts.append(dict(ident, fields=sorted(changed), reason="changed by another session"))
+    else:
+        stamps.append((data, data['version'] + 1))
+
+def _rollup_project_in_db(cursor, project_id):
+    """
+    Recomputes derived actuals for one project from the rows in the DB:
+    Module Actual = Max(Child Actuals) for modules with children (any depth),
+    Project Actual = Max(Top-Level Module Actuals).
+    Same rules as calculate_rollup, but applied to committed state.
+    Returns True if any module row changed.
+    """
+    mods = cursor.execute("SELECT id, parent_module_id FROM modules WHERE project_id=?", (project_id,)).fetchall()
+    children = {}
+    for r in mods:
+        children.setdefault(r['parent_module_id'], []).append(r['id'])
+
+    actuals = {} # (entity_type, id) -> {gw: actual}
+    for r in cursor.execute("""
+            SELECT entity_type, entity_id, gateway, actual_date FROM gateways
+            WHERE (entity_type='project' AND entity_id=?)
+               OR (entity_type='module' AND entity_id IN (SELECT id FROM modules WHERE project_id=?))""",
+            (project_id, project_id)):
+        actuals.setdefault((r['entity_type'], r['entity_id']), {})[r['gateway']] = r['actual_date'] or ''
+
+    module_rows_changed = False
+
+    def write(entity_type, entity_id, gw, value):
+        nonlocal module_rows_changed
+        current = actuals.get((entity_type, entity_id), {})
+        if gw in current:
+            if current[gw] == value:
+                return
+            cursor.execute("UPDATE gateways SET actual_date=? WHERE entity_type=? AND entity_id=? AND gateway=?",
+                           (value, entity_type, entity_id, gw))
+        elif value:
+            cursor.execute("INSERT INTO gateways (entity_type, entity_id, gateway, plan_date, actual_date, ecn) VALUES (?, ?, ?, '', ?, '')",
+                           (entity_type, entity_id, gw, value))
+        else:
+            return
+        actuals.setdefault((entity_type, entity_id), {})[gw] = value
+        if entity_type == 'module':
+            module_rows_changed = True
+
+    # Post-order (children before parents) without recursion, so depth is unbounded
+    top = children.get(None, [])
+    order, stack = [], list(top)
+    while stack:
+        m_id = stack.pop()
+        order.append(m_id)
+        stack.extend(children.get(m_id, []))
+    for m_id in reversed(order):
+        kids = children.get(m_id)
+        if kids:
+            for gw in GATEWAYS:
+                acts = [actuals.get(('module', k), {}).get(gw) for k in kids]
+                write('module', m_id, gw, max([a for a in acts if a], default=''))
+    for gw in GATEWAYS:
+        acts = [actuals.get(('module', m_id), {}).get(gw) for m_id in top]
+        write('project', project_id, gw, max([a for a in acts if a], default=''))
+    return module_rows_changed
+
+@timed()
+def delete_module(module_id, version):
+    """
+    Deletes a module, everything below it (any depth) and their gateways.
+    Raises ConcurrentEditError if the module changed since it was loaded.
+    """
+    with write_transaction() as cursor:
+        row = cursor.execute("SELECT project_id, name, version FROM modules WHERE id=?", (module_id,)).fetchone()
+        if row is None or row['version'] != version:
+            raise ConcurrentEditError([{"entity_type": "module", "entity_id": module_id,
+                                        "name": row['name'] if row else str(module_id),
+                                        "reason": "changed or removed by another session"}])
+        ids = [r['id'] for r in cursor.execute("""
+            WITH RECURSIVE subtree(id) AS (
+                SELECT ?
+                UNION -- not ALL: stops even on a corrupt parent cycle
+                SELECT m.id FROM modules m JOIN subtree ON m.parent_module_id = subtree.id
+            )
+            SELECT id FROM subtree""", (module_id,))]
+        marks = ", ".join("?" * len(ids))
+        cursor.execute(f"DELETE FROM gateways WHERE entity_type='module' AND entity_id IN ({marks})", ids)
+        cursor.execute(f"DELETE FROM modules WHERE id IN ({marks})", ids)
+        _rollup_project_in_db(cursor, row['project_id'])
+        cursor.execute("UPDATE projects SET modules_rev = modules_rev + 1 WHERE id=?", (row['project_id'],))
+        refresh_portfolio_stats(cursor, [row['project_id']])
+        mark_changed(cursor, [row['project_id']], deleted_modules=ids)
+    return True
+
 def backup_database():
     """
     Creates a timestamped backup of the database and maintains only the 30 most recent backups.
@@ -174,7 +1476,13 @@ def backup_database():
     backup_path = os.path.join(BACKUP_DIR, backup_filename)
     
     try:
-        shutil.copy2(DB_FILE, backup_path)
+        # Online backup so pages still in the WAL are included
+        src = sqlite3.connect(DB_FILE)
+        dst = sqlite3.connect(backup_path)
+        with dst:
+            src.backup(dst)
+        dst.close()
+        src.close()
         print(f"Backup created: {backup_filename}")
         
         # Housekeeping: Keep only last 30
@@ -189,6 +1497,12 @@ def backup_database():
         print(f"Backup failed: {e}")
         return False
 
+def backup_database_async():
+    """Runs backup_database on a background thread so it does not hold up the first render."""
+    thread = threading.Thread(target=backup_database, name="autopm-backup")
+    thread.start()
+    return thread
+
 def get_status(plan, actual):
     """
     Calculates status based on Plan vs Actual dates.
@@ -217,115 +1531,306 @@ def get_status(plan, actual):
     except ValueError:
         return 'grey'
 
+def project_health(p):
+    """
+    Health of one project for the KPI cards: 'green', 'yellow' or 'red'.
+    """
+    # User Logic: D4 > D3 > D2 > D1.
+    # "Identify the module released last... update respective projects"
+    # CORRECTED Strategy:
+    # 1. Find the *Latest Gateway* (highest D-level) that has ANY actual data (Max Actual).
+    # 2. The Project Status is SOLELY determined by that one gateway's status.
+    #    Historical delays (e.g. D2 was late, but we are now at D3) are ignored for the Top-Level Status Card.
+    p_status = 'green'
+
+    latest_plan, latest_actual = _latest_released(p)
+
+    # If we found a latest released gateway, use its status
+    if latest_actual and latest_plan:
+        p_status = get_status(latest_plan, latest_actual)
+        if p_status == 'grey': p_status = 'green'
+    return p_status
+
+def _latest_released(p):
+    """(plan, actual) of the latest gateway that has been "released" (has an actual), or (None, None)."""
+    latest_actual = None
+    latest_plan = None
+    for gw in GATEWAYS:
+        # Data is now guaranteed to be dict by load_data/rollup
+        gw_data = p['gateways'].get(gw, {})
+        if gw_data.get('a'):
+            latest_actual = gw_data.get('a')
+            latest_plan = gw_data.get('p')
+    return latest_plan, latest_actual
+
+def project_slip(p):
+    """Days the latest released gateway of a project came in late (0 if on time, pending or unparsable)."""
+    plan, actual = _latest_released(p)
+    try:
+        return max(0, (datetime.strptime(actual, "%Y-%m-%d") - datetime.strptime(plan, "%Y-%m-%d")).days)
+    except (TypeError, ValueError):
+        return 0
+
+@timed()
 def calculate_dashboard_stats(projects):
-    """Calculates summary statistics for the dashboard."""
-    total_projects = len(projects)
-    
-    green = 0
-    yellow = 0
-    red = 0
-    
+    """
+    Calculates summary statistics for the dashboard.
+    (The app reads the materialized version, see portfolio_stats.)
+    """
+    counts = {'green': 0, 'yellow': 0, 'red': 0}
     for p in projects:
-        # User Logic: D4 > D3 > D2 > D1.
-        # "Identify the module released last... update respective projects"
-        # CORRECTED Strategy:
-        # 1. Find the *Latest Gateway* (highest D-level) that has ANY actual data (Max Actual).
-        # 2. The Project Status is SOLELY determined by that one gateway's status.
-        #    Historical delays (e.g. D2 was late, but we are now at D3) are ignored for the Top-Level Status Card.
-        
-        p_status = 'green'
-        
-        p_status = 'green'
-        
-        gw_keys = ['D0', 'D1', 'D2', 'D3', 'D4']
-        
-        # Find the latest gateway that has been "released" (has actuals)
-        latest_released_gw = None
-        latest_actual = None
-        latest_plan = None
-        
-        for gw in gw_keys:
-            # Data is now guaranteed to be dict by load_data/rollup
-            gw_data = p['gateways'].get(gw, {})
-            plan = gw_data.get('p')
-            actual = gw_data.get('a')
-            
-            if actual:
-                latest_released_gw = gw
-                latest_actual = actual
-                latest_plan = plan
-        
-        # If we found a latest released gateway, use its status
-        if latest_released_gw and latest_plan:
-            p_status = get_status(latest_plan, latest_actual)
-            if p_status == 'grey': p_status = 'green'
-
-        if p_status == 'green': green += 1
-        elif p_status == 'yellow': yellow += 1
-        elif p_status == 'red': red += 1
+        counts[project_health(p)] += 1
 
     return {
-        "total": total_projects,
-        "active": total_projects,
-        "green": green,
-        "yellow": yellow,
-        "red": red
+        "total": len(projects),
+        "active": len(projects),
+        "green": counts['green'],
+        "yellow": counts['yellow'],
+        "red": counts['red']
     }
 
+STATUS_RANK = {'grey': 0, 'green': 1, 'yellow': 2, 'red': 3}
+
+def vectorized_status(plan, actual):
+    """
+    Column-wise get_status: 'plan' and 'actual' are Series of YYYY-MM-DD strings.
+    Returns a Series of 'green' / 'yellow' / 'red' / 'grey'.
+    """
+    import pandas as pd
+    import numpy as np
+    p_date = pd.to_datetime(plan, format="%Y-%m-%d", errors='coerce')
+    a_date = pd.to_datetime(actual, format="%Y-%m-%d", errors='coerce')
+    diff = (a_date - p_date).dt.days
+    # NaN (missing or malformed dates) fails every comparison -> grey
+    status = np.select([diff <= 0, diff <= 30, diff > 30], ['green', 'yellow', 'red'], default='grey')
+    return pd.Series(status, index=plan.index)
+
+def format_short_dates(dates):
+    """Formats a Series of YYYY-MM-DD strings as 'Mon DD'; unparsable values are kept as-is."""
+    import pandas as pd
+    parsed = pd.to_datetime(dates, format="%Y-%m-%d", errors='coerce')
+    return parsed.dt.strftime("%b %d").fillna(dates.fillna(''))
+
+@timed()
+def gateway_status_table(projects):
+    """
+    Builds the Dashboard "Project Gateway Status" table in one pass.
+    Columns: Project, Type, Severity, and per gateway <GW>_status,
+    <GW>_actual, <GW>_plan (display text) plus <GW>_a (raw actual, for sorting).
+    """
+    import pandas as pd
+    rows = []
+    for p in projects:
+        row = {"Project": p['name'], "Type": p.get('type', '')}
+        for gw in GATEWAYS:
+            gw_data = p['gateways'].get(gw, {})
+            row[f"{gw}_p"] = gw_data.get('p') or ''
+            row[f"{gw}_a"] = gw_data.get('a') or ''
+        rows.append(row)
+
+    cols = ["Project", "Type"] + [f"{gw}_{k}" for gw in GATEWAYS for k in ('p', 'a')]
+    df = pd.DataFrame(rows, columns=cols)
+    for gw in GATEWAYS:
+        plan, actual = df[f"{gw}_p"], df[f"{gw}_a"]
+        df[f"{gw}_status"] = vectorized_status(plan, actual)
+        df[f"{gw}_actual"] = format_short_dates(actual).where(actual != '', "Pending")
+        df[f"{gw}_plan"] = ("Plan: " + format_short_dates(plan)).where(plan != '', "")
+    df["Severity"] = pd.concat([df[f"{gw}_status"].map(STATUS_RANK) for gw in GATEWAYS], axis=1).max(axis=1)
+    return df
+
+@timed()
+@mem_profiled()
 def calculate_rollup(projects):
     """
     Performs Bottom-Up Date Rollup:
-    1. Module Actual = Max(Sub-Module Actuals)
+    1. Module Actual = Max(Sub-Module Actuals), at every level of the tree
     2. Project Actual = Max(Module Actuals)
-    Updates 'projects' in-place.
+    Updates 'projects' in-place. Projects whose modules are not in memory
+    (headers only, or lazy and not yet loaded) keep their DB-maintained actuals.
     """
     for p in projects:
-        # 1. Rollup Sub-Modules to Modules
-        if 'modules' in p:
-            for m in p['modules']:
-                 # Only if sub-modules exist
-                if m.get('sub_modules'):
-                    for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
-                        max_date = None
-                        for s in m['sub_modules']:
-                            s_act = s['gateways'].get(gw, {}).get('a')
-                            if s_act:
-                                if max_date is None or s_act > max_date:
-                                    max_date = s_act
-                        
-                        # Update Module Actual if valid max found
-                        if max_date:
-                            if gw not in m['gateways']: m['gateways'][gw] = {'p':'', 'a':'', 'ecn':''}
-                            m['gateways'][gw]['a'] = max_date
-                        else:
-                            # If sub-modules exist but have no actuals, current Module Actual should be cleared
-                            # This enforces strict rollup
-                            if gw in m['gateways']:
-                                m['gateways'][gw]['a'] = ""
+        modules = loaded_modules(p)
+        if modules is None:
+            continue
+
+        # 1. Rollup Sub-Modules to Modules, bottom-up in one post-order pass (any depth)
+        for m in _post_order(modules):
+             # Only if sub-modules exist
+            if m.get('sub_modules'):
+                for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
+                    max_date = None
+                    for s in m['sub_modules']:
+                        s_act = s['gateways'].get(gw, {}).get('a')
+                        if s_act:
+                            if max_date is None or s_act > max_date:
+                                max_date = s_act
+                    
+                    # Update Module Actual if valid max found
+                    if max_date:
+                        if gw not in m['gateways']: m['gateways'][gw] = {'p':'', 'a':'', 'ecn':''}
+                        m['gateways'][gw]['a'] = max_date
+                    else:
+                        # If sub-modules exist but have no actuals, current Module Actual should be cleared
+                        # This enforces strict rollup
+                        if gw in m['gateways']:
+                            m['gateways'][gw]['a'] = ""
         
         # 2. Rollup Modules to Project
-        if 'modules' in p:
-            for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
-                max_date = None
-                for m in p['modules']:
-                    m_act = m['gateways'].get(gw, {}).get('a')
-                    if m_act:
-                        if max_date is None or m_act > max_date:
-                            max_date = m_act
+        for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
+            max_date = None
+            for m in modules:
+                m_act = m['gateways'].get(gw, {}).get('a')
+                if m_act:
+                    if max_date is None or m_act > max_date:
+                        max_date = m_act
+            
+            # Update Project Actual
+            if max_date:
+                if gw not in p['gateways']: 
+                    p['gateways'][gw] = {'p':'', 'a':''}
+                # Ensure p['gateways'][gw] is dict (handled by load_data now)
+                if isinstance(p['gateways'][gw], str): # Handle legacy if not loaded via new load_data yet
+                     p['gateways'][gw] = {'p': p['gateways'][gw], 'a': ''}
                 
-                # Update Project Actual
-                if max_date:
-                    if gw not in p['gateways']: 
-                        p['gateways'][gw] = {'p':'', 'a':''}
-                    # Ensure p['gateways'][gw] is dict (handled by load_data now)
-                    if isinstance(p['gateways'][gw], str): # Handle legacy if not loaded via new load_data yet
-                         p['gateways'][gw] = {'p': p['gateways'][gw], 'a': ''}
-                    
-                    p['gateways'][gw]['a'] = max_date
-                else:
-                    # If modules exist but all are empty, clear Project Actual
-                    if gw in p['gateways'] and isinstance(p['gateways'][gw], dict):
-                        p['gateways'][gw]['a'] = ""
+                p['gateways'][gw]['a'] = max_date
+            else:
+                # If modules exist but all are empty, clear Project Actual
+                if gw in p['gateways'] and isinstance(p['gateways'][gw], dict):
+                    p['gateways'][gw]['a'] = ""
+
+# --- Schedule Forecast ---
+
+# julianday() of 1970-01-01, so dates become numpy day numbers (datetime64[D])
+_UNIX_EPOCH_JD = 2440587.5
+_FORECAST_FETCH_ROWS = 50000
+
+@timed()
+@mem_profiled()
+def forecast_gateways(project_ids=None, types=None, today=None):
+    """
+    Projects the missing actuals of every project and module, using array
+    operations over the whole portfolio (one query, no Python loop per entity).
+
+    - Leaf entities (modules without sub-modules, projects without modules):
+      the slip of the latest completed gateway (actual - plan, delays only)
+      is carried forward along the D0 -> D4 chain, so each open gateway is
+      forecast at plan + slip. A gateway cannot be forecast before 'today';
+      that push is carried on to the later gateways as well.
+    - Modules with sub-modules and projects with modules: per gateway, the
+      latest actual-or-forecast of their children (as calculate_rollup does
+      for actuals), at any depth. They are open while any child is.
+
+    Returns a DataFrame with one row per entity: entity_type, entity_id,
+    project_id, depth (0 for projects, 1 for top-level modules), slip (days)
+    and one column per gateway holding the forecast date ('YYYY-MM-DD'; ''
+    for completed gateways and open ones without a plan).
+    """
+    import numpy as np
+    import pandas as pd
+    columns = ["entity_type", "entity_id", "project_id", "depth", "slip"] + GATEWAYS
+    if not os.path.exists(DB_FILE):
+        return pd.DataFrame(columns=columns)
+    today = today or date.today()
+    where, params = _project_filter(project_ids, types)
+    selected = f"SELECT pr.id FROM projects pr{where}"
+
+    conn = get_connection()
+    try:
+        def fetch(sql, params, width):
+            """Query results as a float array (NULL -> nan), fetched in chunks to keep memory low."""
+            cursor = conn.execute(sql, params)
+            cursor.row_factory = None # Plain tuples: numpy reads them much faster than Rows
+            chunks = []
+            while True:
+                batch = cursor.fetchmany(_FORECAST_FETCH_ROWS)
+                if not batch:
+                    break
+                chunks.append(np.array(batch, dtype=float))
+            perf_count('rows', sum(len(c) for c in chunks))
+            return np.concatenate(chunks) if chunks else np.empty((0, width))
+
+        # Entities (kind 0 = project, 1 = module) with their parent and depth
+        entities = fetch(f"""
+            WITH RECURSIVE tree(id, project_id, parent_module_id, depth) AS (
+                SELECT id, project_id, NULL, 1 FROM modules
+                WHERE parent_module_id IS NULL AND project_id IN ({selected})
+                UNION ALL
+                SELECT m.id, tree.project_id, m.parent_module_id, tree.depth + 1
+                FROM modules m JOIN tree ON m.parent_module_id = tree.id
+            )
+            SELECT 0, pr.id, pr.id, NULL, 0 FROM projects pr{where}
+            UNION ALL
+            SELECT 1, id, project_id, parent_module_id, depth FROM tree""", (*params, *params), 5)
+        # Their gateways as day numbers; a flat scan is much cheaper than joining per entity
+        gw_where = ""
+        if where:
+            gw_where = f"""
+            WHERE (g.entity_type = 'project' AND g.entity_id IN ({selected}))
+               OR (g.entity_type = 'module' AND g.entity_id IN (SELECT id FROM modules WHERE project_id IN ({selected})))"""
+        gateways = fetch(f"""
+            SELECT g.entity_type = 'module', g.entity_id, CAST(substr(g.gateway, 2) AS INTEGER),
+                   julianday(NULLIF(g.plan_date, '')) - {_UNIX_EPOCH_JD},
+                   julianday(NULLIF(g.actual_date, '')) - {_UNIX_EPOCH_JD}
+            FROM gateways g{gw_where}""", (*params, *params) if where else (), 5)
+    finally:
+        conn.close()
+    if not len(entities):
+        return pd.DataFrame(columns=columns)
+
+    # Entities in (kind, id) order, located by key = kind * stride + id
+    stride = entities[:, 1].max() + 1
+    entities = entities[np.argsort(entities[:, 0] * stride + entities[:, 1], kind='stable')]
+    kind, ident, project, parent, depth = entities.T
+    keys = kind * stride + ident
+    n = len(keys)
+
+    g_kind, g_ident, gw, plan, actual = gateways.T
+    g_key = g_kind * stride + g_ident
+    row = np.minimum(np.searchsorted(keys, g_key), n - 1)
+    found = (keys[row] == g_key) & (g_ident < stride) & (gw >= 0) & (gw < len(GATEWAYS))
+    row, gw = row[found], gw[found].astype(int)
+    P = np.full((n, len(GATEWAYS)), np.nan)
+    A = np.full((n, len(GATEWAYS)), np.nan)
+    P[row, gw] = plan[found]
+    A[row, gw] = actual[found]
+
+    # Leaf forecast: carry the latest slip (and the 'today' floor) forward along the chain
+    slip_all = A - P
+    has_slip = ~np.isnan(slip_all)
+    last = len(GATEWAYS) - 1 - np.argmax(has_slip[:, ::-1], axis=1)
+    slip = np.where(has_slip.any(axis=1), slip_all[np.arange(n), last], 0)
+    slip = np.maximum(slip, 0)
+    done = ~np.isnan(A)
+    open_ = ~done & ~np.isnan(P)
+    today_num = (np.datetime64(today, 'D') - np.datetime64(0, 'D')).astype(float)
+    shift = np.where(open_, np.fmax(slip[:, None], today_num - P), np.nan)
+    shift = np.fmax.accumulate(shift, axis=1)
+    F = np.where(done, A, np.where(open_, P + shift, np.nan))
+
+    # Rollup, deepest level first: parent = top-level module's project or the parent module
+    is_module = kind == 1
+    parent_key = np.where(np.isnan(parent), project, stride + parent)
+    parent_idx = np.searchsorted(keys, parent_key)
+    has_children = np.zeros(n, dtype=bool)
+    has_children[parent_idx[is_module]] = True
+    F[has_children] = np.nan
+    open_[has_children] = False
+    for level in range(int(depth.max()), 0, -1):
+        kids = np.flatnonzero(depth == level)
+        np.fmax.at(F, parent_idx[kids], F[kids])
+        np.logical_or.at(open_, parent_idx[kids], open_[kids])
+
+    forecast = np.where(open_, F, np.nan).astype('datetime64[D]')
+    df = pd.DataFrame({
+        "entity_type": np.where(is_module, "module", "project"),
+        "entity_id": ident.astype(int),
+        "project_id": project.astype(int),
+        "depth": depth.astype(int),
+        "slip": slip.astype(int),
+    })
+    for i, gw_name in enumerate(GATEWAYS):
+        df[gw_name] = np.char.replace(np.datetime_as_string(forecast[:, i]), "NaT", "")
+    return df
 
 def prepare_gantt_data(projects):
     """Prepares data for Plotly Gantt chart."""
@@ -367,12 +1872,13 @@ def get_matrix_data(projects):
     We wan to see: Project -> Module -> [Gateway Dots on Timeline]
     """
 
-def projects_to_csv(projects):
-    """Converts the nested project list into a flattened CSV string."""
+def _export_rows(projects):
+    """
+    One flat row per module (any depth, parents first), or one per project
+    without modules. 'Parent Module' holds the parent's name ('' at the top).
+    """
     flat_data = []
-    
     for p in projects:
-        # Base project data
         base_row = {
             "Project ID": p['id'],
             "Project Name": p['name'],
@@ -383,44 +1889,30 @@ def projects_to_csv(projects):
             "P_D3": p['gateways'].get('D3', {}).get('p', ''),
             "P_D4": p['gateways'].get('D4', {}).get('p', '')
         }
-        
-        # 1. Project Level Row? Or just Module Rows?
-        # Usually users want 1 row per module.
-        # If no modules, add 1 row for project.
-        
+
+        # Usually users want 1 row per module. If no modules, add 1 row for project.
         if not p.get('modules'):
             flat_data.append(base_row)
-        else:
-            for m in p['modules']:
-                row = base_row.copy()
-                row.update({
-                    "Module ID": m['id'],
-                    "Module Name": m['name'],
-                    "Parent Module": "" # For sub-modules
-                })
-                
-                # Module Gateways
-                for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
-                    g_data = m['gateways'].get(gw, {})
-                    row[f"{gw}_Act"] = g_data.get('a', '')
-                    row[f"{gw}_ECN"] = g_data.get('ecn', '')
-                    
-                flat_data.append(row)
-                
-                # Sub-modules
-                if m.get('sub_modules'):
-                    for s in m['sub_modules']:
-                        s_row = base_row.copy()
-                        s_row.update({
-                            "Module ID": s['id'],
-                            "Module Name": s['name'],
-                            "Parent Module": m['name']
-                        })
-                        for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
-                            sg_data = s['gateways'].get(gw, {})
-                            s_row[f"{gw}_Act"] = sg_data.get('a', '')
-                            s_row[f"{gw}_ECN"] = sg_data.get('ecn', '')
-                        flat_data.append(s_row)
+            continue
+        for m, parent, _ in walk_modules(p['modules']):
+            row = base_row.copy()
+            row.update({
+                "Module ID": m['id'],
+                "Module Name": m['name'],
+                "Parent Module": parent['name'] if parent else ""
+            })
+            for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
+                g_data = m['gateways'].get(gw, {})
+                row[f"{gw}_Act"] = g_data.get('a', '')
+                row[f"{gw}_ECN"] = g_data.get('ecn', '')
+            flat_data.append(row)
+    return flat_data
+
+@timed()
+def projects_to_csv(projects):
+    """Converts the nested project list into a flattened CSV string."""
+    import pandas as pd
+    flat_data = _export_rows(projects)
 
     if not flat_data:
         return ""
@@ -435,54 +1927,13 @@ def projects_to_csv(projects):
     existing_cols = [c for c in cols if c in df.columns]
     
     return df[existing_cols].to_csv(index=False)
-    return df[existing_cols].to_csv(index=False)
 
+@timed()
 def projects_to_excel(projects):
     """Converts the nested project list into an Excel byte stream."""
+    import pandas as pd
     import io
-    flat_data = []
-    
-    for p in projects:
-        base_row = {
-            "Project ID": p['id'],
-            "Project Name": p['name'],
-            "Type": p.get('type', ''),
-            "P_D0": p['gateways'].get('D0', {}).get('p', ''),
-            "P_D1": p['gateways'].get('D1', {}).get('p', ''),
-            "P_D2": p['gateways'].get('D2', {}).get('p', ''),
-            "P_D3": p['gateways'].get('D3', {}).get('p', ''),
-            "P_D4": p['gateways'].get('D4', {}).get('p', '')
-        }
-        
-        if not p.get('modules'):
-            flat_data.append(base_row)
-        else:
-            for m in p['modules']:
-                row = base_row.copy()
-                row.update({
-                    "Module ID": m['id'],
-                    "Module Name": m['name'],
-                    "Parent Module": ""
-                })
-                for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
-                    g_data = m['gateways'].get(gw, {})
-                    row[f"{gw}_Act"] = g_data.get('a', '')
-                    row[f"{gw}_ECN"] = g_data.get('ecn', '')
-                flat_data.append(row)
-                
-                if m.get('sub_modules'):
-                    for s in m['sub_modules']:
-                        s_row = base_row.copy()
-                        s_row.update({
-                            "Module ID": s['id'],
-                            "Module Name": s['name'],
-                            "Parent Module": m['name']
-                        })
-                        for gw in ['D0', 'D1', 'D2', 'D3', 'D4']:
-                            sg_data = s['gateways'].get(gw, {})
-                            s_row[f"{gw}_Act"] = sg_data.get('a', '')
-                            s_row[f"{gw}_ECN"] = sg_data.get('ecn', '')
-                        flat_data.append(s_row)
+    flat_data = _export_rows(projects)
 
     output = io.BytesIO()
     if flat_data:
@@ -501,6 +1952,122 @@ def projects_to_excel(projects):
     output.seek(0)
     return output
 
+# --- Delta Export ---
+# For sync jobs: only the projects and modules changed after a given
+# change_seq, one flat row each (gateway columns as in the CSV export), plus
+# a 'delete' row per entity deleted since. modified_seq and deleted_entities
+# are maintained by triggers (see migrate_to_sqlite.CHANGE_TRIGGERS). A job
+# starts with a full export (since=None) and passes the returned 'seq' as
+# 'since' next time.
+
+DELTA_FORMATS = ('csv', 'jsonl', 'parquet')
+DELTA_COLUMNS = (["seq", "op", "entity_type", "entity_id", "project_id", "parent_module_id", "name", "type"]
+                 + [f"P_{gw}" for gw in GATEWAYS]
+                 + [f"{gw}_{kind}" for gw in GATEWAYS for kind in ("Act", "ECN")])
+_DELTA_BATCH = 5000 # Rows per Parquet row group
+
+_DELTA_ENTITY_SQL = {
+    'project': """
+        SELECT e.modified_seq, e.id, e.id, NULL, e.name, e.type, g.gateway, g.plan_date, g.actual_date, g.ecn
+        FROM projects e LEFT JOIN gateways g ON g.entity_type = 'project' AND g.entity_id = e.id
+        {where} ORDER BY e.id""",
+    'module': """
+        SELECT e.modified_seq, e.id, e.project_id, e.parent_module_id, e.name, NULL, g.gateway, g.plan_date, g.actual_date, g.ecn
+        FROM modules e LEFT JOIN gateways g ON g.entity_type = 'module' AND g.entity_id = e.id
+        {where} ORDER BY e.id""",
+}
+
+def _changed_rows(cursor, since=None):
+    """Yields the delta rows (lists in DELTA_COLUMNS order): changed projects, changed modules, then deletes."""
+    gw_index = {gw: i for i, gw in enumerate(GATEWAYS)}
+    n = len(GATEWAYS)
+    for entity_type, sql in _DELTA_ENTITY_SQL.items():
+        where, params = ("", ()) if since is None else ("WHERE e.modified_seq > ?", (since,))
+        row = None
+        # One row per (entity, gateway), ordered by entity: fold each entity's rows into one
+        for seq, e_id, p_id, parent_id, name, e_type, gw, plan, actual, ecn in cursor.execute(sql.format(where=where), params):
+            if row is None or row[3] != e_id:
+                if row is not None:
+                    yield row
+                row = [seq, 'upsert', entity_type, e_id, p_id, parent_id, name, e_type] + [''] * (3 * n)
+            i = gw_index.get(gw)
+            if i is not None:
+                row[8 + i] = plan or ''
+                row[8 + n + 2 * i] = actual or ''
+                row[9 + n + 2 * i] = ecn or ''
+        if row is not None:
+            yield row
+    if since is not None:
+        for seq, entity_type, e_id, p_id in cursor.execute("""
+                SELECT deleted_seq, entity_type, entity_id, project_id FROM deleted_entities
+                WHERE deleted_seq > ? ORDER BY deleted_seq""", (since,)):
+            yield [seq, 'delete', entity_type, e_id, p_id] + [None] * (len(DELTA_COLUMNS) - 5)
+
+def _write_delta_jsonl(out, rows):
+    count = 0
+    for count, row in enumerate(rows, 1):
+        out.write(json.dumps(dict(zip(DELTA_COLUMNS, row))) + "\n")
+    return count
+
+def _write_delta_csv(out, rows):
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(DELTA_COLUMNS)
+    count = 0
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+    return count
+
+def _write_delta_parquet(out, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ints = {"seq", "entity_id", "project_id", "parent_module_id"}
+    schema = pa.schema([(c, pa.int64() if c in ints else pa.string()) for c in DELTA_COLUMNS])
+    count = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        while True:
+            batch = list(itertools.islice(rows, _DELTA_BATCH))
+            if not batch:
+                break
+            columns = [pa.array(col, type=field.type) for col, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            count += len(batch)
+        if not count:
+            writer.write_table(schema.empty_table()) # A readable file even when nothing changed
+    return count
+
+_DELTA_WRITERS = {'csv': _write_delta_csv, 'jsonl': _write_delta_jsonl, 'parquet': _write_delta_parquet}
+
+@timed()
+def export_changes(out, since=None, fmt='jsonl'):
+    """
+    Writes the entities changed after change_seq 'since' (everything when
+    None) to the open file 'out' (text for csv/jsonl, binary for parquet).
+    Rows and the returned seq come from one read snapshot, so nothing is
+    missed between runs. Returns {"since", "seq", "rows"}, or
+    None if the format is unknown or needs a missing package.
+    """
+    if fmt not in _DELTA_WRITERS:
+        print(f"Unknown export format: {fmt} (expected one of {', '.join(DELTA_FORMATS)})")
+        return None
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet # noqa: F401
+        except ImportError:
+            print("Parquet export needs pyarrow (pip install pyarrow)")
+            return None
+
+    conn = get_connection()
+    conn.row_factory = None
+    conn.isolation_level = None # Explicit read transaction below
+    try:
+        conn.execute("BEGIN")
+        seq = conn.execute("SELECT value FROM meta WHERE key = 'change_seq'").fetchone()[0]
+        count = _DELTA_WRITERS[fmt](out, _changed_rows(conn.cursor(), since))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return {"since": since, "seq": seq, "rows": count}
+
 def get_csv_template_data():
     """Returns a CSV string with headers for the upload template."""
     headers = [
@@ -515,11 +2082,15 @@ def get_csv_template_data():
     ]
     return ",".join(headers)
 
+@timed()
 def process_csv_upload(csv_file, current_projects):
     """
     Parses an uploaded CSV file and updates the projects list.
-    Merges new data with existing projects/modules.
+    Merges new data with existing projects/modules. New projects and modules
+    only join the list once the whole file has parsed and they have ids.
     """
+    import pandas as pd
+    new_projects, new_modules = [], [] # Created by this upload; new_modules holds (siblings, module)
     try:
         df = pd.read_csv(csv_file)
         
@@ -535,6 +2106,14 @@ def process_csv_upload(csv_file, current_projects):
 
         # Index existing projects for quick lookup
         proj_map = {p['name']: p for p in current_projects}
+        module_index = {} # project name -> {module name: first module with that name}
+
+        def find_module(p, name):
+            if p['name'] not in module_index:
+                index = module_index[p['name']] = {}
+                for m, _, _ in walk_modules(p['modules']):
+                    index.setdefault(m['name'], m)
+            return module_index[p['name']].get(name)
         
         for _, row in df.iterrows():
             p_name = get_val(row, "Project Name")
@@ -545,14 +2124,14 @@ def process_csv_upload(csv_file, current_projects):
             # --- Project Handling ---
             if p_name not in proj_map:
                 new_p = {
-                    "id": int(datetime.now().timestamp() * 1000) + random.randint(0, 999),
+                    "id": None, # Assigned in bulk below
                     "name": p_name,
                     "type": p_type if p_type else "New",
                     "gateways": {},
                     "modules": []
                 }
-                current_projects.append(new_p)
                 proj_map[p_name] = new_p
+                new_projects.append(new_p)
             
             p = proj_map[p_name]
             # Update Project Type if provided
@@ -574,44 +2153,27 @@ def process_csv_upload(csv_file, current_projects):
                 parent_m_name = get_val(row, "Parent Module")
                 
                 # Find or Create Module
-                # Hierarchy: Project -> Module -> SubModule
-                
-                target_module = None
-                is_sub = False
-                
-                # Check if this is a sub-module
+                # Hierarchy: Project -> Module -> Sub-module -> ... (any depth). The parent
+                # is looked up by name anywhere in the tree; exports list parents first.
+                siblings = p['modules']
                 if parent_m_name:
-                    # Find parent first
-                    parent = next((m for m in p['modules'] if m['name'] == parent_m_name), None)
+                    parent = find_module(p, parent_m_name)
                     if parent:
-                        if 'sub_modules' not in parent: parent['sub_modules'] = []
-                        
-                        target_module = next((s for s in parent['sub_modules'] if s['name'] == m_name), None)
-                        if not target_module:
-                            target_module = {
-                                "id": int(datetime.now().timestamp() * 1000) + random.randint(0, 999),
-                                "name": m_name,
-                                "gateways": {}
-                            }
-                            parent['sub_modules'].append(target_module)
-                            is_sub = True
-                    else:
-                        # Fallback: Treat as root module if parent not found? Or Create Parent?
-                        # For simplicity, treat as root and log warning? or just create root.
-                        # Let's create as root for now to avoid data loss.
-                        pass 
-
-                if not target_module and not is_sub:
-                     # Search top-level modules
-                    target_module = next((m for m in p['modules'] if m['name'] == m_name), None)
-                    if not target_module:
-                        target_module = {
-                            "id": int(datetime.now().timestamp() * 1000) + random.randint(0, 999),
-                            "name": m_name,
-                            "gateways": {},
-                            "sub_modules": []
-                        }
-                        p['modules'].append(target_module)
+                        siblings = parent.setdefault('sub_modules', [])
+                    # Parent not found: create as root module to avoid data loss
+
+                target_module = next((m for m in siblings if m['name'] == m_name), None)
+                if not target_module:
+                    target_module = {
+                        "id": None, # Assigned in bulk below
+                        "name": m_name,
+                        "gateways": {},
+                        "sub_modules": []
+                    }
+                    siblings.append(target_module)
+                    new_modules.append((siblings, target_module))
+                    if p_name in module_index:
+                        module_index[p_name].setdefault(m_name, target_module)
                 
                 # --- Update Module Gateways ---
                 if target_module:
@@ -630,8 +2192,17 @@ def process_csv_upload(csv_file, current_projects):
                         if act_d: target_module['gateways'][gw]['a'] = act_d
                         if ecn: target_module['gateways'][gw]['ecn'] = ecn
 
+        # One id block per table for everything this upload created
+        for table, created in (('projects', new_projects), ('modules', [m for _, m in new_modules])):
+            for entity, new_id in zip(created, allocate_ids(table, len(created))):
+                entity['id'] = new_id
+
+        current_projects.extend(new_projects)
         return current_projects, "Success"
         
     except Exception as e:
+        # Take out what this upload created, so a later save_data cannot write half of it without ids
+        for siblings, m in reversed(new_modules):
+            siblings[:] = [s for s in siblings if s is not m]
         return current_projects, f"Error processing CSV: {str(e)}"
 
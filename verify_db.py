@@ -1,47 +1,239 @@
+"""
+Integrity and consistency checks for a project database.
 
-import utils
-import sqlite3
+Every check is one set-based SQL query over the whole database (no per-row
+Python), run on a read-only connection, so it is safe against the live
+database while the app is running and takes seconds even with a million
+gateway rows. Nothing is repaired; the report lists what is wrong.
+
+Checks:
+    orphan_modules          modules whose project does not exist
+    missing_parents         sub-modules whose parent module does not exist
+    cross_project_parents   sub-modules whose parent belongs to another project
+    module_cycles           modules that never reach a top-level module (parent cycle)
+    orphan_gateways         gateway rows of a missing project/module, or of an unknown entity type
+    unknown_gateways        gateway names outside D0..D4
+    duplicate_gateways      more than one row for the same (entity, gateway)
+    malformed_dates         plan/actual dates that are not empty and not a valid YYYY-MM-DD
+    module_rollup           parent module actuals != max of their sub-modules' actuals
+    project_rollup          project actuals != max of their top-level modules' actuals
+
+Usage:
+    python verify_db.py                         # check project_tracker.db (or AUTOPM_DB)
+    python verify_db.py --db synthetic.db --json report.json
+    python verify_db.py --json -                # JSON report on stdout
+    python verify_db.py --quick-check           # also run SQLite's own page-level check
+
+Exits 0 when every check passes, 1 when any finds problems, 2 when the
+database cannot be read.
+"""
+import argparse
+import json
 import os
+import pathlib
+import sqlite3
+import sys
+import time
+from datetime import datetime
 
-DB_FILE = "project_tracker.db"
-
-def test_load():
-    print("Testing utils.load_data()...")
-    projects = utils.load_data()
-    print(f"Loaded {len(projects)} projects.")
-    
-    for p in projects:
-        print(f" - {p['name']} (ID: {p['id']})")
-        print(f"   Gateways: {p.get('gateways')}")
-        print(f"   Modules: {len(p.get('modules', []))}")
-        for m in p.get('modules', []):
-            print(f"     * {m['name']} (ID: {m['id']})")
-            if m.get('sub_modules'):
-                print(f"       Sub-modules: {len(m['sub_modules'])}")
-
-def test_save():
-    print("\nTesting utils.save_data()...")
-    projects = utils.load_data()
-    if not projects:
-        print("No projects to save.")
-        return
-
-    # Modify something small
-    projects[0]['name'] = projects[0]['name'] + " (Updated)"
-    
-    success = utils.save_data(projects)
-    if success:
-        print("Save successful.")
-        
-        # Verify persistence
-        projects_new = utils.load_data()
-        print(f"New Name: {projects_new[0]['name']}")
-    else:
-        print("Save failed.")
+import utils
+
+SAMPLE_ROWS = 20 # Offending rows included in the report per check
+
+# date() alone accepts days 29-31 in any month; the '+0 days' round trip normalizes them away
+_VALID_DATE = "({col} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' AND date({col}, '+0 days') IS {col})"
+
+# Actual that a parent should have for each gateway: the max of its children's
+# non-empty actuals ('' when none), the same rule as utils.calculate_rollup.
+# Every (parent, gateway) pair is checked, so a missing parent row is caught too.
+_ROLLUP = """
+    WITH gw(gateway) AS (SELECT value FROM json_each(:gateways)),
+    expected AS (
+        SELECT {parent} AS parent_id, g.gateway, MAX(NULLIF(g.actual_date, '')) AS actual
+        FROM modules c
+        JOIN gateways g ON g.entity_type = 'module' AND g.entity_id = c.id
+        WHERE {children}
+        GROUP BY parent_id, g.gateway
+    )
+    SELECT '{entity}' AS entity_type, p.id AS entity_id, gw.gateway,
+           IFNULL(pg.actual_date, '') AS actual, IFNULL(e.actual, '') AS expected
+    FROM {parents} p
+    CROSS JOIN gw
+    LEFT JOIN expected e ON e.parent_id = p.id AND e.gateway = gw.gateway
+    LEFT JOIN gateways pg ON pg.entity_type = '{entity}' AND pg.entity_id = p.id AND pg.gateway = gw.gateway
+    WHERE IFNULL(pg.actual_date, '') IS NOT IFNULL(e.actual, '')
+    ORDER BY p.id, gw.gateway
+"""
+
+# name -> (description, query returning one row per problem)
+CHECKS = {
+    "orphan_modules": (
+        "Modules whose project does not exist",
+        """SELECT m.id, m.project_id, m.name FROM modules m
+           WHERE NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = m.project_id)
+           ORDER BY m.id"""),
+    "missing_parents": (
+        "Sub-modules whose parent module does not exist",
+        """SELECT m.id, m.project_id, m.parent_module_id, m.name FROM modules m
+           WHERE m.parent_module_id IS NOT NULL
+             AND NOT EXISTS (SELECT 1 FROM modules pm WHERE pm.id = m.parent_module_id)
+           ORDER BY m.id"""),
+    "cross_project_parents": (
+        "Sub-modules whose parent module belongs to another project",
+        """SELECT m.id, m.project_id, m.parent_module_id, pm.project_id AS parent_project_id
+           FROM modules m JOIN modules pm ON pm.id = m.parent_module_id
+           WHERE pm.project_id IS NOT m.project_id
+           ORDER BY m.id"""),
+    "module_cycles": (
+        "Modules that never reach a top-level module (their parent chain is a cycle)",
+        """WITH RECURSIVE reachable(id) AS (
+               SELECT id FROM modules WHERE parent_module_id IS NULL
+               UNION
+               SELECT m.id FROM modules m JOIN reachable r ON m.parent_module_id = r.id
+           )
+           SELECT m.id, m.project_id, m.parent_module_id FROM modules m
+           WHERE m.id NOT IN (SELECT id FROM reachable)
+             AND EXISTS (SELECT 1 FROM modules pm WHERE pm.id = m.parent_module_id)
+           ORDER BY m.id"""),
+    "orphan_gateways": (
+        "Gateway rows whose project/module does not exist, or with an unknown entity type",
+        """SELECT g.id, g.entity_type, g.entity_id, g.gateway FROM gateways g
+           WHERE CASE g.entity_type
+                     WHEN 'project' THEN NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = g.entity_id)
+                     WHEN 'module' THEN NOT EXISTS (SELECT 1 FROM modules m WHERE m.id = g.entity_id)
+                     ELSE 1
+                 END
+           ORDER BY g.id"""),
+    "unknown_gateways": (
+        "Gateway rows with a name outside D0..D4",
+        """SELECT g.id, g.entity_type, g.entity_id, g.gateway FROM gateways g
+           WHERE g.gateway IS NULL OR g.gateway NOT IN (SELECT value FROM json_each(:gateways))
+           ORDER BY g.id"""),
+    "duplicate_gateways": (
+        "More than one row for the same entity and gateway",
+        """SELECT entity_type, entity_id, gateway, COUNT(*) AS rows, GROUP_CONCAT(id) AS ids
+           FROM gateways
+           GROUP BY entity_type, entity_id, gateway
+           HAVING COUNT(*) > 1
+           ORDER BY entity_type, entity_id, gateway"""),
+    "malformed_dates": (
+        "Plan or actual dates that are neither empty nor a valid YYYY-MM-DD",
+        f"""SELECT id, entity_type, entity_id, gateway, plan_date, actual_date FROM gateways
+            WHERE NOT (IFNULL(plan_date, '') = '' OR {_VALID_DATE.format(col='plan_date')})
+               OR NOT (IFNULL(actual_date, '') = '' OR {_VALID_DATE.format(col='actual_date')})
+            ORDER BY id"""),
+    "module_rollup": (
+        "Actuals of modules with sub-modules that differ from the max of their sub-modules' actuals",
+        _ROLLUP.format(entity='module', parent='c.parent_module_id', children='c.parent_module_id IS NOT NULL',
+                       parents='(SELECT DISTINCT parent_module_id AS id FROM modules WHERE parent_module_id IS NOT NULL)')),
+    "project_rollup": (
+        "Project actuals that differ from the max of their top-level modules' actuals",
+        _ROLLUP.format(entity='project', parent='c.project_id', children='c.parent_module_id IS NULL',
+                       parents='projects')),
+}
+
+def connect_readonly(path):
+    """Read-only connection: the checks can never modify the database (or upgrade its schema)."""
+    conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+def run_check(conn, sql, samples=SAMPLE_ROWS):
+    """Returns (number of offending rows, the first 'samples' of them as dicts)."""
+    count, rows = 0, []
+    for row in conn.execute(sql, {"gateways": json.dumps(utils.GATEWAYS)}):
+        if count < samples:
+            rows.append(dict(row))
+        count += 1
+    return count, rows
+
+def verify(path, names=None, samples=SAMPLE_ROWS, quick_check=False):
+    """
+    Runs the checks (all, or the given names) against the database at 'path'
+    and returns the report as a dict. Raises sqlite3.Error if it cannot be opened.
+    """
+    started = time.perf_counter()
+    conn = connect_readonly(path)
+    try:
+        # The counts and all checks see the same snapshot, even if the app commits meanwhile
+        conn.execute("BEGIN")
+        report = {
+            "database": os.path.abspath(path),
+            "checked_at": datetime.now().isoformat(timespec="seconds"),
+            "counts": {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                       for t in ("projects", "modules", "gateways")},
+            "checks": [],
+        }
+        if quick_check:
+            check_start = time.perf_counter()
+            messages = [r[0] for r in conn.execute("PRAGMA quick_check")]
+            bad = [] if messages == ["ok"] else messages
+            report["checks"].append({"name": "sqlite_quick_check", "description": "SQLite page and index structure",
+                                     "count": len(bad), "samples": bad[:samples],
+                                     "ms": round((time.perf_counter() - check_start) * 1000, 1)})
+        for name, (description, sql) in CHECKS.items():
+            if names and name not in names:
+                continue
+            check_start = time.perf_counter()
+            entry = {"name": name, "description": description}
+            try:
+                entry["count"], entry["samples"] = run_check(conn, sql, samples)
+            except sqlite3.OperationalError as e:
+                entry["count"], entry["samples"], entry["error"] = None, [], str(e)
+            entry["ms"] = round((time.perf_counter() - check_start) * 1000, 1)
+            report["checks"].append(entry)
+        conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+    report["ok"] = all(c["count"] == 0 for c in report["checks"])
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+def print_report(report):
+    counts = report["counts"]
+    print(f"{report['database']}: {counts['projects']} projects, {counts['modules']} modules, "
+          f"{counts['gateways']} gateways")
+    for c in report["checks"]:
+        if c.get("error"):
+            status = f"ERROR {c['error']}"
+        else:
+            status = "ok" if c["count"] == 0 else f"{c['count']} problem(s)"
+        print(f"  {c['name']:24s} {status:30s} {c['ms']:9.1f} ms")
+        for row in c["samples"][:5] if c["count"] else []:
+            print(f"      {row}")
+    print("All checks passed." if report["ok"] else "Problems found.")
+    print(f"Checked in {report['elapsed_ms'] / 1000:.2f}s")
 
 if __name__ == "__main__":
-    if not os.path.exists(DB_FILE):
-        print("DB file not found!")
+    parser = argparse.ArgumentParser(description="Read-only integrity and consistency checks for a project database.")
+    parser.add_argument("--db", default=utils.DB_FILE, help="Database to check (default: AUTOPM_DB or project_tracker.db)")
+    parser.add_argument("--only", default="", help=f"Comma-separated checks (default: all): {', '.join(CHECKS)}")
+    parser.add_argument("--samples", type=int, default=SAMPLE_ROWS, help="Offending rows listed per check")
+    parser.add_argument("--json", metavar="FILE", help="Write the report as JSON to FILE ('-' for stdout)")
+    parser.add_argument("--quick-check", action="store_true", help="Also run PRAGMA quick_check (reads every page)")
+    args = parser.parse_args()
+
+    names = [n for n in args.only.split(",") if n]
+    unknown = [n for n in names if n not in CHECKS]
+    if unknown:
+        parser.error(f"Unknown check: {', '.join(unknown)}")
+    if not os.path.exists(args.db):
+        print(f"Database not found: {args.db}")
+        sys.exit(2)
+
+    try:
+        report = verify(args.db, names, args.samples, args.quick_check)
+    except sqlite3.Error as e:
+        print(f"Cannot read {args.db}: {e}")
+        sys.exit(2)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
     else:
-        test_load()
-        test_save()
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+        print_report(report)
+    sys.exit(0 if report["ok"] else 1)